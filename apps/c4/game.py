@@ -7,12 +7,37 @@ if typing.TYPE_CHECKING:
     import discord
 
 
+WIDTH = 7
+HEIGHT = 6
+STRIDE = HEIGHT + 1
+"""Bits per column, the extra bit on top of each column keeps lines from wrapping into the next one."""
+
+
+def has_four(bitboard: int) -> bool:
+    """Check whether a bitboard has four in a row, in any direction."""
+    # vertical, horizontal, and the two diagonals
+    for shift in (1, STRIDE, STRIDE - 1, STRIDE + 1):
+        pairs = bitboard & (bitboard >> shift)
+        if pairs & (pairs >> (2 * shift)):
+            return True
+    return False
+
+
 class ConnectFour:
+    """A game of Connect Four on bitboards.
+
+    Each player's discs are the bits of one int, bit `col * STRIDE + row` being the
+    cell at that column and row, row 0 at the bottom. `heights` holds the bit of the
+    next free cell of every column.
+    """
+
     def __init__(
         self,
         players: dict[str, "discord.Member"],
     ) -> None:
-        self.board = [["⚫ " for _ in range(7)] for _ in range(6)]
+        self.bitboards = [0, 0]
+        self.heights = [col * STRIDE for col in range(WIDTH)]
+        self.moves = 0
         self.players = players
 
         keys = list(players.keys())
@@ -27,8 +52,17 @@ class ConnectFour:
     def get_board(self) -> "discord.Embed":
         embed = DefaultEmbed(f"{self.p1.display_name} vs {self.p2.display_name}")
         embed.description = ""
-        for row in self.board:
-            embed.description += "".join(row) + "\n"
+        p1_board, p2_board = self.bitboards
+        for row in reversed(range(HEIGHT)):
+            for col in range(WIDTH):
+                bit = 1 << (col * STRIDE + row)
+                if p1_board & bit:
+                    embed.description += self.p1_color
+                elif p2_board & bit:
+                    embed.description += self.p2_color
+                else:
+                    embed.description += "⚫ "
+            embed.description += "\n"
         embed.description += "1️⃣ 2️⃣ 3️⃣ 4️⃣ 5️⃣ 6️⃣ 7️⃣"
 
         embed.set_footer(text="點擊下方按鈕來選擇要下的位置")
@@ -39,57 +73,19 @@ class ConnectFour:
     def play(self, col: int, color: str) -> None:
         if color != self.current_player:
             raise NotYourTurnError
-
-        row = 5
-        while row >= 0:
-            if self.board[row][col] == "⚫ ":
-                self.board[row][col] = self.current_player
-                break
-            row -= 1
-        else:
+        if self.heights[col] == col * STRIDE + HEIGHT:
             raise ColumnFullError
 
-        if self.check_win(row, col):
+        player = 0 if self.current_player == self.p1_color else 1
+        self.bitboards[player] |= 1 << self.heights[col]
+        self.heights[col] += 1
+        self.moves += 1
+
+        if has_four(self.bitboards[player]):
             raise GameOverError(self.current_player)
-        elif self.check_draw():
+        if self.moves == WIDTH * HEIGHT:
             raise DrawError
 
         self.current_player = (
             self.p2_color if self.current_player == self.p1_color else self.p1_color
         )
-
-    def check_win(self, row: int, col: int) -> bool:
-        player = self.board[row][col]
-        # check horizontal
-        if "".join(self.board[row]).count(player * 4):
-            return True
-        # check vertical
-        if "".join([self.board[i][col] for i in range(6)]).count(player * 4):
-            return True
-        # check diagonal
-        if (
-            col <= 3
-            and row <= 2
-            and "".join([self.board[row + i][col + i] for i in range(4)]).count(player * 4)
-        ):
-            return True
-        if (
-            col <= 3
-            and row >= 3
-            and "".join([self.board[row - i][col + i] for i in range(4)]).count(player * 4)
-        ):
-            return True
-        if (
-            col >= 3
-            and row <= 2
-            and "".join([self.board[row + i][col - i] for i in range(4)]).count(player * 4)
-        ):
-            return True
-        return bool(
-            col >= 3
-            and row >= 3
-            and "".join([self.board[row - i][col - i] for i in range(4)]).count(player * 4)
-        )
-
-    def check_draw(self) -> bool:
-        return all(cell != "⚫ " for row in self.board for cell in row)
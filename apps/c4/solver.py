@@ -0,0 +1,247 @@
+import asyncio
+import time
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+from dev.enum import Difficulty
+
+from .game import HEIGHT, STRIDE, WIDTH
+
+if typing.TYPE_CHECKING:
+    from .game import ConnectFour
+
+SEARCH_LIMITS: dict[Difficulty, tuple[int, float]] = {
+    Difficulty.EASY: (2, 0.2),
+    Difficulty.NORMAL: (6, 1.0),
+    Difficulty.HARD: (WIDTH * HEIGHT, 3.0),
+}
+"""Search depth and seconds per move of each difficulty."""
+
+TABLE_SIZE = 1 << 20
+WIN = 1000
+"""Score of winning right now, a win n moves later scores n less."""
+
+_BOTTOM = sum(1 << (col * STRIDE) for col in range(WIDTH))
+_BOARD = _BOTTOM * ((1 << HEIGHT) - 1)
+_CENTER = ((1 << HEIGHT) - 1) << (WIDTH // 2 * STRIDE)
+_ORDER = sorted(range(WIDTH), key=lambda col: abs(WIDTH // 2 - col))
+"""Columns from the center outwards, the center being part of the most lines."""
+
+_EXACT, _LOWER, _UPPER = 0, 1, 2
+_table: dict[int, tuple[int, int, int, int]] = {}
+"""position + mask -> (depth, flag, score, column), kept per worker process."""
+
+_executor: ProcessPoolExecutor | None = None
+
+
+class _TimeoutError(Exception):
+    pass
+
+
+def _column_mask(col: int) -> int:
+    return ((1 << HEIGHT) - 1) << (col * STRIDE)
+
+
+def _winning_cells(position: int, mask: int) -> int:
+    """Get the empty cells that would complete four in a row for `position`."""
+    # vertical
+    r = (position << 1) & (position << 2) & (position << 3)
+
+    for shift in (STRIDE, STRIDE - 1, STRIDE + 1):
+        # horizontal and the two diagonals, the cell can be at either end or in a gap
+        p = (position << shift) & (position << (2 * shift))
+        r |= p & (position << (3 * shift))
+        r |= p & (position >> shift)
+        p = (position >> shift) & (position >> (2 * shift))
+        r |= p & (position << shift)
+        r |= p & (position >> (3 * shift))
+
+    return r & (_BOARD ^ mask)
+
+
+def _safe_moves(position: int, mask: int, playable: int) -> int:
+    """Drop the moves that let the opponent win right after, 0 if every move does."""
+    opponent_wins = _winning_cells(position ^ mask, mask)
+    forced = playable & opponent_wins
+    # the opponent wins next move unless every one of their winning cells is blocked
+    if forced & (forced - 1):
+        return 0
+    if forced:
+        playable = forced
+    # never play right below a cell the opponent is waiting for
+    return playable & ~(opponent_wins >> 1)
+
+
+def _cutoff(entry: tuple[int, int, int, int], depth: int, alpha: int, beta: int) -> bool:
+    entry_depth, flag, score, _ = entry
+    if entry_depth < depth:
+        return False
+    if flag == _LOWER:
+        return score >= beta
+    if flag == _UPPER:
+        return score <= alpha
+    return True
+
+
+def _store(key: int, depth: int, alpha: int, beta: int, score: int, col: int | None) -> None:
+    if len(_table) >= TABLE_SIZE:
+        _table.clear()
+    if score <= alpha:
+        flag = _UPPER
+    elif score >= beta:
+        flag = _LOWER
+    else:
+        flag = _EXACT
+    _table[key] = (depth, flag, score, col)
+
+
+def _settle(position: int, mask: int, moves: int) -> tuple[int, tuple[int, int | None] | None]:
+    """Get the moves worth searching, or the result if the position is already decided.
+
+    Returns:
+        tuple[int, tuple[int, int | None] | None]: The playable moves, and the score and
+            column of a decided position.
+    """
+    if moves == WIDTH * HEIGHT:
+        return 0, (0, None)
+
+    playable = (mask + _BOTTOM) & _BOARD
+    wins = _winning_cells(position, mask) & playable
+    if wins:
+        return playable, (WIN - moves - 1, (wins & -wins).bit_length() // STRIDE)
+
+    playable = _safe_moves(position, mask, playable)
+    if not playable:
+        return 0, (-(WIN - moves - 2), None)
+    return playable, None
+
+
+def _evaluate(position: int, mask: int) -> int:
+    """Score a position that wasn't searched to the end, from the player to move."""
+    opponent = position ^ mask
+    threats = (
+        _winning_cells(position, mask).bit_count() - _winning_cells(opponent, mask).bit_count()
+    )
+    center = (position & _CENTER).bit_count() - (opponent & _CENTER).bit_count()
+    return threats * 4 + center
+
+
+class _Search:
+    def __init__(self, deadline: float) -> None:
+        self.deadline = deadline
+        self.nodes = 0
+
+    def ordered_moves(self, position: int, mask: int, playable: int, first: int | None) -> list:
+        moves = []
+        for col in _ORDER:
+            move = playable & _column_mask(col)
+            if move:
+                threats = _winning_cells(position | move, mask | move).bit_count()
+                moves.append((col == first, threats, col, move))
+        # sorted is stable, so columns with equal scores stay center first
+        moves.sort(key=lambda m: (m[0], m[1]), reverse=True)
+        return [(col, move) for _, _, col, move in moves]
+
+    def negamax(self, position: int, mask: int, moves: int, depth: int, alpha: int, beta: int):
+        """Search a position, `position` being the discs of the player to move.
+
+        Returns:
+            tuple[int, int | None]: The score and the best column.
+        """
+        self.nodes += 1
+        if not self.nodes & 1023 and time.perf_counter() > self.deadline:
+            raise _TimeoutError
+
+        playable, result = _settle(position, mask, moves)
+        if result is not None:
+            return result
+        if depth == 0:
+            return _evaluate(position, mask), None
+
+        key = position + mask
+        first = None
+        entry = _table.get(key)
+        if entry is not None:
+            if _cutoff(entry, depth, alpha, beta):
+                return entry[2], entry[3]
+            first = entry[3]
+
+        original_alpha = alpha
+        best_score, best_col = -WIN, None
+        for col, move in self.ordered_moves(position, mask, playable, first):
+            score, _ = self.negamax(
+                position ^ mask, mask | move, moves + 1, depth - 1, -beta, -alpha
+            )
+            score = -score
+            if score > best_score:
+                best_score, best_col = score, col
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        _store(key, depth, original_alpha, beta, best_score, best_col)
+        return best_score, best_col
+
+
+def search(position: int, mask: int, moves: int, depth: int, budget: float) -> int:
+    """Find a move with iterative deepening, stopping at `depth` or when `budget` runs out.
+
+    Args:
+        position (int): Bitboard of the player to move.
+        mask (int): Bitboard of every disc.
+        moves (int): Number of discs played.
+        depth (int): The deepest search to run.
+        budget (float): Seconds the search may take, the last finished depth is used after.
+
+    Returns:
+        int: The column to play, from 0.
+    """
+    searcher = _Search(time.perf_counter() + budget)
+    playable = (mask + _BOTTOM) & _BOARD
+    best = next(col for col in _ORDER if playable & _column_mask(col))
+
+    for current in range(1, min(depth, WIDTH * HEIGHT - moves) + 1):
+        try:
+            score, col = searcher.negamax(position, mask, moves, current, -WIN, WIN)
+        except _TimeoutError:
+            break
+        if col is not None:
+            best = col
+        # a forced result won't change with a deeper search
+        if abs(score) > WIN - WIDTH * HEIGHT - 1:
+            break
+    return best
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor  # noqa: PLW0603
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=2)
+    return _executor
+
+
+def shutdown() -> None:
+    """Shut down the worker processes, they are started again on the next search."""
+    global _executor  # noqa: PLW0603
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def choose_move(game: "ConnectFour", difficulty: Difficulty) -> int:
+    """Pick a move for the player whose turn it is, searched in a worker process.
+
+    Args:
+        game (ConnectFour): The game.
+        difficulty (Difficulty): How deep and long to search.
+
+    Returns:
+        int: The column to play, from 0.
+    """
+    player = 0 if game.current_player == game.p1_color else 1
+    mask = game.bitboards[0] | game.bitboards[1]
+    depth, budget = SEARCH_LIMITS[difficulty]
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(), search, game.bitboards[player], mask, game.moves, depth, budget
+    )
@@ -0,0 +1,96 @@
+import asyncio
+import typing
+
+import discord
+from loguru import logger
+
+from apps import matches
+from dev.model import DefaultEmbed
+
+if typing.TYPE_CHECKING:
+    import asyncpg
+
+    from dev.model import ConnectFourMatch
+
+
+class StickyManager:
+    """Keeps a "back to game" message at the bottom of connect four threads.
+
+    Every message pushes the repost back by `delay` seconds, so a burst of chat ends in a
+    single repost once the thread goes quiet. Sticky IDs are kept on the matches and only
+    written to the database by `flush`.
+    """
+
+    def __init__(self, delay: float = 5.0) -> None:
+        self.delay = delay
+        self._pending: dict[int, asyncio.Task[None]] = {}
+        """Reposts still waiting out the delay, by thread ID."""
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._dirty: set[int] = set()
+
+    def bump(self, thread: discord.Thread, match: "ConnectFourMatch") -> None:
+        """Schedule a repost, replacing the one already waiting in the thread."""
+        task = self._pending.pop(thread.id, None)
+        if task is not None:
+            task.cancel()
+        task = asyncio.create_task(self._repost(thread, match))
+        self._pending[thread.id] = task
+        # holds the task while it posts, after it leaves _pending
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _repost(self, thread: discord.Thread, match: "ConnectFourMatch") -> None:
+        await asyncio.sleep(self.delay)
+        # past this point a new bump starts its own timer instead of cancelling a half-done repost
+        self._pending.pop(thread.id, None)
+        if matches.connect_four.get(thread.id) is not match:
+            return
+
+        try:
+            if match.sticky_id is not None:
+                await thread.get_partial_message(match.sticky_id).delete()
+        except discord.NotFound:
+            pass
+        except discord.HTTPException:
+            logger.warning(f"Failed to delete the sticky in {thread.id}", exc_info=True)
+
+        try:
+            sticky = await thread.send(
+                embed=DefaultEmbed(description=f"[點我回到遊戲]({match.board_link})")
+            )
+        except discord.HTTPException:
+            logger.warning(f"Failed to send the sticky in {thread.id}", exc_info=True)
+            return
+        match.sticky_id = sticky.id
+        self._dirty.add(thread.id)
+
+    async def flush(self, pool: "asyncpg.Pool") -> None:
+        """Write the sticky IDs that changed since the last flush to the database.
+
+        Args:
+            pool (asyncpg.Pool): The database pool.
+        """
+        dirty = [
+            match
+            for thread_id in self._dirty
+            if (match := matches.connect_four.get(thread_id)) is not None
+        ]
+        self._dirty.clear()
+        if not dirty:
+            return
+
+        await pool.execute(
+            """
+            UPDATE connect_four c SET sticky_id = s.sticky_id
+            FROM unnest($1::bigint[], $2::bigint[]) AS s(channel_id, sticky_id)
+            WHERE c.channel_id = s.channel_id
+            """,
+            [match.channel_id for match in dirty],
+            [match.sticky_id for match in dirty],
+        )
+
+    def cancel(self) -> None:
+        """Cancel every repost, waiting or not."""
+        for task in self._tasks:
+            task.cancel()
+        self._pending.clear()
@@ -6,26 +6,54 @@ import discord
 from discord import ui
 from loguru import logger
 
-from apps.flow import flow_transaction
+from apps.flow import settle
+from apps.matches import end_connect_four, start_connect_four
 from dev.model import BaseView, DefaultEmbed, ErrorEmbed, Inter
 from utility.utils import get_dt_now
 
 from .exceptions import ColumnFullError, DrawError, GameOverError, NotYourTurnError
 from .game import ConnectFour
+from .solver import choose_move
 
 if typing.TYPE_CHECKING:
     import asyncpg
 
+    from dev.enum import Difficulty
+
 
 class ConnectFourView(BaseView):
-    def __init__(self, game: ConnectFour, flow: int | None = None) -> None:
+    def __init__(
+        self,
+        game: ConnectFour,
+        flow: int | None = None,
+        difficulty: "Difficulty | None" = None,
+    ) -> None:
         super().__init__(timeout=None)
         self.game = game
         self.flow = flow
+        self.difficulty = difficulty
+        """Set when player two is Shenhe, who then plays with this difficulty."""
 
         for column in range(1, 8):
             self.add_item(ColumnButton(column, column // 5))
 
+    def reset_buttons(self) -> None:
+        style = (
+            discord.ButtonStyle.green
+            if self.game.current_player == self.game.p2_color
+            else discord.ButtonStyle.blurple
+        )
+        self.clear_items()
+        for column in range(1, 8):
+            self.add_item(ColumnButton(column, column // 5, style))
+
+    async def edit(self, i: discord.Interaction, **kwargs: typing.Any) -> None:
+        """Edit the board message, whether or not the interaction was responded to already."""
+        if i.response.is_done():
+            await i.edit_original_response(**kwargs)
+        else:
+            await i.response.edit_message(**kwargs)
+
     async def interaction_check(self, i: discord.Interaction) -> bool:
         if i.user in self.game.players.values():
             return True
@@ -35,9 +63,10 @@ class ConnectFourView(BaseView):
             )
             return False
 
-    async def delete_thread(self, i: discord.Interaction) -> None:
-        await asyncio.sleep(600)
+    async def delete_thread(self, i: Inter) -> None:
         assert isinstance(i.channel, discord.Thread)
+        await end_connect_four(i.channel.id, i.client.pool)
+        await asyncio.sleep(600)
         await i.channel.delete()
 
     async def add_history(self, pool: "asyncpg.Pool", winner: str | None = None) -> None:
@@ -98,7 +127,7 @@ class ConnectFourView(BaseView):
         if isinstance(error, ColumnFullError):
             await i.response.send_message(embed=ErrorEmbed("這一列已經滿了"), ephemeral=True)
         elif isinstance(error, GameOverError):
-            await i.response.edit_message(embed=self.game.get_board(), view=None)
+            await self.edit(i, embed=self.game.get_board(), view=None)
 
             winner = self.game.players[error.winner]
             loser = next(p for p in self.game.players.values() if p != winner)
@@ -110,14 +139,14 @@ class ConnectFourView(BaseView):
             await i.followup.send(embed=embed)
 
             if self.flow:
-                await flow_transaction(winner.id, self.flow, i.client.pool)
-                await flow_transaction(loser.id, -self.flow, i.client.pool)
+                await settle(loser.id, winner.id, self.flow, i.client.pool, reason="connect_four")
 
             await self.add_history(i.client.pool, error.winner)
-            await self.add_win_lose(i.client.pool, error.winner)
+            if self.difficulty is None:
+                await self.add_win_lose(i.client.pool, error.winner)
             await self.delete_thread(i)
         elif isinstance(error, DrawError):
-            await i.response.edit_message(embed=self.game.get_board(), view=None)
+            await self.edit(i, embed=self.game.get_board(), view=None)
 
             embed = DefaultEmbed("平手")
             embed.set_footer(text="討論串將會在十分鐘後刪除")
@@ -152,24 +181,21 @@ class ColumnButton(ui.Button):
         self.view: ConnectFourView
 
     async def callback(self, i: discord.Interaction) -> None:
-        game = self.view.game
+        view = self.view
+        game = view.game
 
-        color = ""
-        player = None
-        for player in game.players.values():
-            if i.user == player:
-                break
+        color = next(color for color, player in game.players.items() if player == i.user)
         game.play(self.column - 1, color)
 
-        self.view.clear_items()
-        style = (
-            discord.ButtonStyle.blurple
-            if player != next(iter(game.players.values()))
-            else discord.ButtonStyle.green
-        )
-        for column in range(1, 8):
-            self.view.add_item(ColumnButton(column, column // 5, style))
-        await i.response.edit_message(embed=game.get_board(), view=self.view)
+        view.reset_buttons()
+        await i.response.edit_message(embed=game.get_board(), view=view)
+
+        if view.difficulty is not None:
+            column = await choose_move(game, view.difficulty)
+            game.play(column, game.p2_color)
+
+            view.reset_buttons()
+            await i.edit_original_response(embed=game.get_board(), view=view)
 
 
 class ColorSelectView(BaseView):
@@ -179,6 +205,7 @@ class ColorSelectView(BaseView):
         p2: discord.Member,
         embed: discord.Embed,
         flow: int | None = None,
+        difficulty: "Difficulty | None" = None,
     ) -> None:
         super().__init__(timeout=600.0)
         self.p1 = p1
@@ -188,6 +215,7 @@ class ColorSelectView(BaseView):
 
         self.embed = embed
         self.flow = flow
+        self.difficulty = difficulty
 
         self.add_item(ColorSelect())
 
@@ -203,6 +231,15 @@ class ColorSelectView(BaseView):
 
 class ColorSelect(ui.Select):
     def __init__(self, selected: str | None = None) -> None:
+        options = self.get_options(selected)
+        super().__init__(
+            placeholder="選擇你的棋子顏色",
+            options=options,
+        )
+        self.view: ColorSelectView
+
+    @staticmethod
+    def get_options(selected: str | None = None) -> list[discord.SelectOption]:
         options = [
             discord.SelectOption(label="紅色", value="🔴", emoji="🔴"),
             discord.SelectOption(label="黃色", value="🟡", emoji="🟡"),
@@ -214,12 +251,7 @@ class ColorSelect(ui.Select):
         selected_option = discord.utils.get(options, value=selected)
         if selected_option is not None:
             options.remove(selected_option)
-
-        super().__init__(
-            placeholder="選擇你的棋子顏色",
-            options=options,
-        )
-        self.view: ColorSelectView
+        return options
 
     async def callback(self, i: Inter) -> typing.Any:
         view = self.view
@@ -243,7 +275,17 @@ class ColorSelect(ui.Select):
             )
 
             view.clear_items()
-            view.add_item(ColorSelect(self.values[0]))
+            if view.p2.bot:
+                # Shenhe takes the first color left
+                view.p2_color = f"{self.get_options(self.values[0])[0].value} "
+                embed.set_field_at(
+                    1,
+                    name="玩家二",
+                    value=f"{view.p2.mention} - {view.p2_color}",
+                    inline=False,
+                )
+            else:
+                view.add_item(ColorSelect(self.values[0]))
 
         elif i.user.id == view.p2.id:
             view.p2_color = self.values[0] + " "
@@ -257,20 +299,16 @@ class ColorSelect(ui.Select):
         await i.response.edit_message(embed=embed, view=view)
 
         if view.p1_color is not None and view.p2_color is not None:
-            self.disabled = True
+            view.disable_items()
             await i.edit_original_response(view=view)
             message = await i.original_response()
             thread = await message.create_thread(name=f"四子棋-{str(uuid4())[:4]}")
 
             game = ConnectFour({view.p1_color: view.p1, view.p2_color: view.p2})
-            view = ConnectFourView(game, self.view.flow)
+            view = ConnectFourView(game, self.view.flow, self.view.difficulty)
             board = await thread.send(
                 embed=game.get_board(),
                 view=view,
             )
 
-            await i.client.pool.execute(
-                "INSERT INTO connect_four (channel_id, board_link) VALUES ($1, $2)",
-                thread.id,
-                board.jump_url,
-            )
+            await start_connect_four(thread.id, board.jump_url, i.client.pool)
@@ -1,15 +1,88 @@
-from datetime import datetime, time, timedelta
+from collections import OrderedDict, defaultdict
+from datetime import time, timedelta
 from typing import TYPE_CHECKING
 
 from loguru import logger
 
+from apps import ledger
+from utility.rank import RankIndex
 from utility.utils import get_dt_now, time_in_range
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable
+
     import asyncpg
 
     from dev.enum import TimeType
 
+BALANCE_CACHE_SIZE = 2048
+"""Maximum number of balances kept in memory."""
+
+balance_ranks = RankIndex()
+"""Rank of every flow account by balance, kept current by the functions in this module."""
+_balances: OrderedDict[int, int] = OrderedDict()
+"""Least recently used balances, written through by every mutation in this module."""
+_registered: set[int] = set()
+"""IDs of users known to have a flow account."""
+_CLAIM_SLOTS = ("morning", "noon", "night")
+_claims: dict[int, list[int]] = {}
+"""Date ordinals of each user's last morning, noon and night claim, 0 if never claimed."""
+
+
+def _remember(user_id: int, flow: int) -> None:
+    _registered.add(user_id)
+    _balances[user_id] = flow
+    _balances.move_to_end(user_id)
+    if len(_balances) > BALANCE_CACHE_SIZE:
+        _balances.popitem(last=False)
+    balance_ranks.set(user_id, flow)
+
+
+def _remember_read(user_id: int, flow: int) -> int:
+    """Cache a balance that was read, unless a write cached a newer one while it was awaited.
+
+    Returns:
+        int: The balance now cached for the user.
+    """
+    cached = _balances.get(user_id)
+    if cached is not None:
+        _balances.move_to_end(user_id)
+        return cached
+    _remember(user_id, flow)
+    return flow
+
+
+def forget_account(user_id: int) -> None:
+    """Drop everything known about a user's flow account from memory.
+
+    Call this whenever the account row is deleted outside of `remove_account`.
+
+    Args:
+        user_id (int): The user's ID.
+    """
+    _registered.discard(user_id)
+    _balances.pop(user_id, None)
+    _claims.pop(user_id, None)
+    balance_ranks.remove(user_id)
+
+
+async def load_accounts(pool: "asyncpg.Pool") -> None:
+    """Load the registered users and their greeting claims, and rebuild `balance_ranks`.
+
+    Args:
+        pool (asyncpg.Pool): The database pool.
+    """
+    rows = await pool.fetch("SELECT user_id, flow, morning, noon, night FROM flow_accounts")
+    balances = {row["user_id"]: row["flow"] for row in rows}
+    _registered.clear()
+    _registered.update(balances)
+    balance_ranks.load(balances)
+    _claims.clear()
+    for row in rows:
+        _claims[row["user_id"]] = [
+            row[slot].toordinal() if row[slot] is not None else 0 for slot in _CLAIM_SLOTS
+        ]
+
 
 async def register_account(user_id: int, pool: "asyncpg.Pool") -> None:
     """Register a user's flow account.
@@ -18,49 +91,261 @@ async def register_account(user_id: int, pool: "asyncpg.Pool") -> None:
         user_id (int): The user's ID.
         pool (asyncpg.Pool): The database pool.
     """
+    if user_id in _registered:
+        return
+
+    async with pool.acquire() as conn:
+        registered = await _register_accounts(conn, [user_id])
+    if registered:
+        _remember_read(user_id, 0)
+    else:
+        _registered.add(user_id)
+
+
+class InsufficientFlowError(Exception):
+    def __init__(self, user_id: int, balance: int) -> None:
+        self.user_id = user_id
+        self.balance = balance
+
+
+async def _register_accounts(conn: "asyncpg.Connection", user_ids: list[int]) -> list[int]:
+    # the caller's transaction may still roll back, so _registered is only updated after it
+    user_ids = [user_id for user_id in user_ids if user_id not in _registered]
+    if not user_ids:
+        return []
+
     default = get_dt_now() - timedelta(days=1)
-    result = await pool.execute(
-        "INSERT INTO flow_accounts (user_id, morning, noon, night) VALUES ($1, $2, $3, $4) ON CONFLICT DO NOTHING",
-        user_id,
-        default,
-        default,
+    rows = await conn.fetch(
+        """
+        WITH new AS (
+            INSERT INTO flow_accounts (user_id, morning, noon, night)
+            SELECT user_id, $2, $2, $2 FROM unnest($1::bigint[]) AS user_id
+            ON CONFLICT DO NOTHING
+            RETURNING user_id
+        )
+        SELECT user_id FROM new
+        """,
+        user_ids,
         default,
     )
-    if result == "INSERT 0 1":
-        logger.info(f"Registered flow account for {user_id}")
+    for row in rows:
+        logger.info(f"Registered flow account for {row['user_id']}")
+    return [row["user_id"] for row in rows]
+
+
+async def transfer(
+    src: int | None,
+    dst: int | None,
+    amount: int,
+    pool: "asyncpg.Pool",
+    *,
+    reason: str | None = None,
+) -> tuple[int | None, int | None]:
+    """Move flow from one account to another in one transaction, None being the bank.
+
+    Missing user accounts are registered first. A user account can't go below zero,
+    the bank can. The transfer is appended to the ledger in the same statement; the
+    bank has no row to update, its balance is derived from the ledger.
+
+    Args:
+        src (int | None): ID of the user paying, None for the bank.
+        dst (int | None): ID of the user being paid, None for the bank.
+        amount (int): The amount of flow to move, must not be negative.
+        pool (asyncpg.Pool): The database pool.
+        reason (str | None): What the transfer is for, kept in the ledger.
+
+    Raises:
+        ValueError: If the amount is negative.
+        InsufficientFlowError: If `src` doesn't have enough flow.
+
+    Returns:
+        tuple[int | None, int | None]: The new balances of `src` and `dst`, None for the bank.
+    """
+    if amount < 0:
+        msg = "Transfer amount must not be negative"
+        raise ValueError(msg)
+
+    no_account = "SELECT NULL::int AS flow"
+    debit = (
+        no_account
+        if src is None
+        else "UPDATE flow_accounts SET flow = flow - $1 WHERE user_id = $2 AND flow >= $1 RETURNING flow"
+    )
+    credit = (
+        no_account
+        if dst is None
+        else "UPDATE flow_accounts SET flow = flow + $1 WHERE user_id = $3 AND EXISTS (SELECT 1 FROM src) RETURNING flow"
+    )
 
+    async with pool.acquire() as conn, conn.transaction():
+        await _register_accounts(conn, [a for a in (src, dst) if a is not None])
+        if src == dst:
+            # both sides would update the same row, which one statement can't do
+            balance = await _get_flow(conn, src) if src is not None else None
+            if src is not None and balance is not None:
+                balance = _remember_read(src, balance)
+            return balance, balance
 
-async def flow_transaction(user_id: int, amount: int, pool: "asyncpg.Pool") -> None:
-    """Transfer flow from the bank to a user's flow account.
+        row = await conn.fetchrow(
+            f"""
+            WITH src AS ({debit}), dst AS ({credit}), entry AS (
+                INSERT INTO flow_ledger (src, dst, amount, reason, time)
+                SELECT $2, $3, $1, $4, $5 WHERE EXISTS (SELECT 1 FROM src)
+            )
+            SELECT EXISTS (SELECT 1 FROM src) AS ok, (SELECT flow FROM src) AS src, (SELECT flow FROM dst) AS dst
+            """,
+            amount,
+            src,
+            dst,
+            reason,
+            get_dt_now(),
+        )
+        assert row is not None
+        if not row["ok"]:
+            assert src is not None
+            raise InsufficientFlowError(src, await _get_flow(conn, src))
+
+    logger.info(f"Transferred {amount} flow from {src or 'bank'} to {dst or 'bank'} ({reason})")
+    for user_id, balance in ((src, row["src"]), (dst, row["dst"])):
+        if user_id is not None:
+            _remember(user_id, balance)
+    return row["src"], row["dst"]
+
+
+async def settle(
+    src: int, dst: int, amount: int, pool: "asyncpg.Pool", *, reason: str | None = None
+) -> tuple[int, int | None, int | None]:
+    """Transfer `amount` flow between two users, or all of `src`'s flow if that isn't enough.
+
+    Args:
+        src (int): ID of the user paying.
+        dst (int): ID of the user being paid.
+        amount (int): The amount of flow owed.
+        pool (asyncpg.Pool): The database pool.
+        reason (str | None): What the transfer is for, kept in the ledger.
+
+    Returns:
+        tuple[int, int | None, int | None]: The amount actually moved, and the new balances of `src` and `dst`.
+    """
+    try:
+        src_flow, dst_flow = await transfer(src, dst, amount, pool, reason=reason)
+    except InsufficientFlowError as e:
+        amount = max(e.balance, 0)
+        src_flow, dst_flow = await transfer(src, dst, amount, pool, reason=reason)
+    return amount, src_flow, dst_flow
+
+
+async def bulk_transfer(
+    entries: "Iterable[tuple[int, int]]",
+    pool: "asyncpg.Pool",
+    *,
+    clamp: bool = False,
+    reason: str | None = None,
+) -> dict[int, int]:
+    """Apply many bank transfers in one transaction, a positive delta paying the user and a negative one charging them.
+
+    Missing accounts are registered with one INSERT, every balance is changed by one
+    UPDATE ... FROM unnest(...) and the bank side is written to the ledger with one COPY.
+
+    Args:
+        entries (Iterable[tuple[int, int]]): (user_id, delta) pairs, deltas of the same user are added up.
+        pool (asyncpg.Pool): The database pool.
+        clamp (bool): Charge users who can't afford it what they have, instead of failing.
+        reason (str | None): What the transfers are for, kept in the ledger.
+
+    Raises:
+        InsufficientFlowError: If a user can't afford their charge and `clamp` is False.
+
+    Returns:
+        dict[int, int]: The delta actually applied to each user.
+    """
+    deltas: defaultdict[int, int] = defaultdict(int)
+    for user_id, delta in entries:
+        deltas[user_id] += delta
+    if not deltas:
+        return {}
+
+    async with pool.acquire() as conn, conn.transaction():
+        await _register_accounts(conn, list(deltas))
+        rows = await conn.fetch(
+            """
+            UPDATE flow_accounts AS a SET flow = a.flow + d.delta
+            FROM (
+                SELECT d.user_id, CASE WHEN $3 THEN GREATEST(d.delta, LEAST(-f.flow, 0)) ELSE d.delta END AS delta
+                FROM unnest($1::bigint[], $2::int[]) AS d(user_id, delta)
+                JOIN flow_accounts f USING (user_id)
+                FOR UPDATE OF f
+            ) AS d
+            WHERE a.user_id = d.user_id AND a.flow + d.delta >= LEAST(a.flow, 0)
+            RETURNING a.user_id, a.flow, d.delta
+            """,
+            list(deltas),
+            list(deltas.values()),
+            clamp,
+        )
+        if len(rows) < len(deltas):
+            short = next(u for u in deltas if u not in {row["user_id"] for row in rows})
+            raise InsufficientFlowError(short, await _get_flow(conn, short))
+        await ledger.record(
+            conn,
+            [
+                (None, row["user_id"], row["delta"], reason)
+                if row["delta"] > 0
+                else (row["user_id"], None, -row["delta"], reason)
+                for row in rows
+                if row["delta"]
+            ],
+        )
+
+    logger.info(f"Bulk transferred flow to {len(rows)} users ({reason})")
+    for row in rows:
+        _remember(row["user_id"], row["flow"])
+    return {row["user_id"]: row["delta"] for row in rows}
+
+
+async def _get_flow(conn: "asyncpg.Connection", user_id: int) -> int:
+    return await conn.fetchval("SELECT flow FROM flow_accounts WHERE user_id = $1", user_id)
+
+
+async def flow_transaction(
+    user_id: int, amount: int, pool: "asyncpg.Pool", *, reason: str | None = None
+) -> None:
+    """Transfer flow from the bank to a user's flow account, or back if the amount is negative.
 
     Args:
         user_id (int): The user's ID.
         amount (int): The amount of flow to transfer.
         pool (asyncpg.Pool): The database pool.
+        reason (str | None): What the transfer is for, kept in the ledger.
+
+    Raises:
+        InsufficientFlowError: If the amount is negative and the user doesn't have enough flow.
     """
-    logger.info(f"Transferring {amount} flow to {user_id}")
-    await register_account(user_id, pool)
-    await pool.execute(
-        "UPDATE flow_accounts SET flow = flow + $1 WHERE user_id = $2", amount, user_id
-    )
-    await pool.execute("UPDATE bank SET flow = flow - $1", amount)
+    if amount < 0:
+        await transfer(user_id, None, -amount, pool, reason=reason)
+    else:
+        await transfer(None, user_id, amount, pool, reason=reason)
 
 
 async def remove_account(user_id: int, pool: "asyncpg.Pool") -> None:
-    """Remove a user's flow account.
+    """Remove a user's flow account and return its flow to the bank.
 
     Args:
         user_id (int): The user's ID.
         pool (asyncpg.Pool): The database pool.
     """
     logger.info(f"Removing flow account for {user_id}")
-    flow = await get_balance(user_id, pool)
-    await flow_transaction(user_id, flow, pool)
-    await pool.execute("DELETE FROM flow_accounts WHERE user_id = $1", user_id)
+    async with pool.acquire() as conn, conn.transaction():
+        flow = await conn.fetchval(
+            "DELETE FROM flow_accounts WHERE user_id = $1 RETURNING flow", user_id
+        )
+        if flow:
+            await ledger.record(conn, [(user_id, None, flow, "leave")])
+    forget_account(user_id)
 
 
 async def get_balance(user_id: int, pool: "asyncpg.Pool") -> int:
-    """Get a user's flow balance.
+    """Get a user's flow balance, from memory if it's cached.
 
     Args:
         user_id (int): The user's ID.
@@ -69,12 +354,65 @@ async def get_balance(user_id: int, pool: "asyncpg.Pool") -> int:
     Returns:
         int: The user's flow balance.
     """
+    flow = _balances.get(user_id)
+    if flow is not None:
+        _balances.move_to_end(user_id)
+        return flow
+
     await register_account(user_id, pool)
-    return await pool.fetchval("SELECT flow FROM flow_accounts WHERE user_id = $1", user_id)
+    flow = await pool.fetchval("SELECT flow FROM flow_accounts WHERE user_id = $1", user_id)
+    return _remember_read(user_id, flow)
+
+
+async def get_balances(user_ids: "Iterable[int]", pool: "asyncpg.Pool") -> dict[int, int]:
+    """Get several users' flow balances, registering the users who have no account yet.
+
+    Cached balances are answered from memory, the rest are registered and read in one statement.
+
+    Args:
+        user_ids (Iterable[int]): The users' IDs.
+        pool (asyncpg.Pool): The database pool.
+
+    Returns:
+        dict[int, int]: The balance of each user.
+    """
+    balances: dict[int, int] = {}
+    missing: list[int] = []
+    for user_id in dict.fromkeys(user_ids):
+        flow = _balances.get(user_id)
+        if flow is None:
+            missing.append(user_id)
+        else:
+            _balances.move_to_end(user_id)
+            balances[user_id] = flow
+    if not missing:
+        return balances
+
+    default = get_dt_now() - timedelta(days=1)
+    rows = await pool.fetch(
+        """
+        WITH new AS (
+            INSERT INTO flow_accounts (user_id, morning, noon, night)
+            SELECT user_id, $2, $2, $2 FROM unnest($1::bigint[]) AS user_id
+            ON CONFLICT DO NOTHING
+            RETURNING user_id, flow
+        )
+        SELECT user_id, flow, TRUE AS new FROM new
+        UNION ALL
+        SELECT user_id, flow, FALSE AS new FROM flow_accounts WHERE user_id = ANY($1::bigint[])
+        """,
+        missing,
+        default,
+    )
+    for row in rows:
+        if row["new"]:
+            logger.info(f"Registered flow account for {row['user_id']}")
+        balances[row["user_id"]] = _remember_read(row["user_id"], row["flow"])
+    return balances
 
 
 async def get_bank(pool: "asyncpg.Pool") -> int:
-    """Get the amount of flow in the bank.
+    """Get the amount of flow in the bank, derived from the ledger.
 
     Args:
         pool (asyncpg.Pool): The database pool.
@@ -82,7 +420,7 @@ async def get_bank(pool: "asyncpg.Pool") -> int:
     Returns:
         int: The amount of flow in the bank.
     """
-    return await pool.fetchval("SELECT flow FROM bank")
+    return await ledger.get_bank(pool)
 
 
 async def free_flow(
@@ -90,6 +428,9 @@ async def free_flow(
 ) -> bool:
     """Give a user free flow if the current time is in the range [start, end], and the last time they got free flow was not today. Returns True if the user got free flow, False otherwise.
 
+    Whether the user already claimed today is answered from memory, the database is
+    only written to when the claim is granted.
+
     Args:
         user_id (int): The user's ID.
         start (time): Beginning of the time range.
@@ -100,19 +441,44 @@ async def free_flow(
     Returns:
         bool: True if the user got free flow, False otherwise.
     """
-    await register_account(user_id, pool)
     now = get_dt_now()
-    if time_in_range(start, end, now.time()):
-        last_give: datetime | None = await pool.fetchval(
-            f"SELECT {time_type.value} FROM flow_accounts WHERE user_id = $1", user_id
+    if not time_in_range(start, end, now.time()):
+        return False
+
+    slot = _CLAIM_SLOTS.index(time_type.value)
+    claims = _claims.setdefault(user_id, [0, 0, 0])
+    today = now.toordinal()
+    if claims[slot] == today:
+        return False
+
+    # registers the account if needed, grants the flow, stamps the claim and writes the
+    # ledger entry in one statement
+    default = now - timedelta(days=1)
+    slots = ", ".join(_CLAIM_SLOTS)
+    values = ", ".join("$2" if s == time_type.value else "$3" for s in _CLAIM_SLOTS)
+    flow = await pool.fetchval(
+        f"""
+        WITH claim AS (
+            INSERT INTO flow_accounts AS a (user_id, flow, {slots}) VALUES ($1, 1, {values})
+            ON CONFLICT (user_id) DO UPDATE
+            SET flow = a.flow + 1, {time_type.value} = EXCLUDED.{time_type.value}
+            WHERE a.{time_type.value} IS NULL OR a.{time_type.value}::date < EXCLUDED.{time_type.value}::date
+            RETURNING a.flow
+        ), entry AS (
+            INSERT INTO flow_ledger (src, dst, amount, reason, time)
+            SELECT NULL, $1, 1, $4, $2 WHERE EXISTS (SELECT 1 FROM claim)
         )
-        if last_give is not None and last_give.day != now.day:
-            logger.info(f"Free flow for {user_id}, last_give is {last_give} ({time_type.value})")
-            await flow_transaction(user_id, 1, pool)
-            await pool.execute(
-                f"UPDATE flow_accounts SET {time_type.value} = $1 WHERE user_id = $2",
-                now,
-                user_id,
-            )
-            return True
-    return False
+        SELECT flow FROM claim
+        """,
+        user_id,
+        now,
+        default,
+        f"greeting:{time_type.value}",
+    )
+    claims[slot] = today
+    if flow is None:
+        return False
+
+    logger.info(f"Free flow for {user_id} ({time_type.value})")
+    _remember(user_id, flow)
+    return True
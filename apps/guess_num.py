@@ -0,0 +1,164 @@
+import math
+import mmap
+import os
+import random
+from collections import Counter
+from itertools import permutations
+from operator import itemgetter
+from pathlib import Path
+
+from loguru import logger
+
+CODES: tuple[str, ...] = tuple("".join(p) for p in permutations("0123456789", 4))
+"""Every 4-digit code without repeated digits, 5040 of them."""
+CODE_INDEX = {code: index for index, code in enumerate(CODES)}
+CACHE_PATH = Path(".cache/guess_num_scores.bin")
+
+_size = len(CODES)
+_matrix: mmap.mmap | bytes | None = None
+
+
+def get_score(answer: str, guess: str) -> tuple[int, int]:
+    """a: 猜對位置, b: 猜對數字
+
+    Args:
+        answer (str): 正確答案
+        guess (str): 猜測答案
+
+    Returns:
+        tuple[int, int]: A 和 B
+    """
+    a = sum(x == y for x, y in zip(answer, guess, strict=True))
+    return a, len(set(answer) & set(guess)) - a
+
+
+def _build_matrix() -> bytes:
+    # a score is stored as 5a + b, which is 4 * (digits in place) + (digits in common);
+    # each row is summed as big ints of one byte per code, no byte ever carries past 24
+    in_place = [
+        [
+            int.from_bytes(bytes(4 * (code[pos] == digit) for code in CODES))
+            for digit in "0123456789"
+        ]
+        for pos in range(4)
+    ]
+    has_digit = {
+        digit: int.from_bytes(bytes(digit in code for code in CODES)) for digit in "0123456789"
+    }
+    rows = [
+        sum(in_place[pos][int(digit)] for pos, digit in enumerate(guess))
+        + sum(has_digit[digit] for digit in guess)
+        for guess in CODES
+    ]
+    return b"".join(row.to_bytes(_size) for row in rows)
+
+
+def load_matrix() -> None:
+    """Memory-map the score matrix from the cache file, building it first if there is none.
+
+    It's loaded on first use otherwise. The file is `len(CODES) ** 2` bytes, the score of
+    guessing `CODES[g]` against `CODES[c]` being at `g * len(CODES) + c`.
+    """
+    global _matrix  # noqa: PLW0603
+    if _matrix is not None:
+        return
+
+    if not CACHE_PATH.exists() or CACHE_PATH.stat().st_size != _size * _size:
+        matrix = _build_matrix()
+        try:
+            CACHE_PATH.parent.mkdir(exist_ok=True)
+            tmp = CACHE_PATH.with_suffix(".tmp")
+            tmp.write_bytes(matrix)
+            os.replace(tmp, CACHE_PATH)
+        except OSError:
+            logger.warning("Failed to cache the guess number score matrix", exc_info=True)
+            _matrix = matrix
+            return
+        logger.info(f"Cached the guess number score matrix at {CACHE_PATH}")
+
+    with CACHE_PATH.open("rb") as f:
+        _matrix = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _row(guess: int) -> bytes:
+    load_matrix()
+    assert _matrix is not None
+    return _matrix[guess * _size : (guess + 1) * _size]
+
+
+def _scores(guess: int, candidates: list[int]) -> tuple[int, ...]:
+    row = _row(guess)
+    if len(candidates) == 1:
+        return (row[candidates[0]],)
+    # gathers every candidate's score in one C call
+    return itemgetter(*candidates)(row)
+
+
+def get_candidates(answer: str, guesses: list[str]) -> list[int]:
+    """Get the indexes in `CODES` of the answers that would have scored the same on every guess.
+
+    Args:
+        answer (str): The real answer.
+        guesses (list[str]): The guesses made so far.
+
+    Returns:
+        list[int]: The codes still possible.
+    """
+    candidates = list(range(_size))
+    for guess in guesses:
+        if guess not in CODE_INDEX:
+            # saved before guesses were limited to ASCII digits
+            continue
+        a, b = get_score(answer, guess)
+        candidates = filter_candidates(candidates, guess, a, b)
+    return candidates
+
+
+def filter_candidates(candidates: list[int], guess: str, a: int, b: int) -> list[int]:
+    """Keep the candidates that score aAbB against a guess.
+
+    Args:
+        candidates (list[int]): Indexes in `CODES`.
+        guess (str): The guess.
+        a (int): A of the guess.
+        b (int): B of the guess.
+
+    Returns:
+        list[int]: The candidates left.
+    """
+    score = a * 5 + b
+    return [
+        c
+        for c, s in zip(candidates, _scores(CODE_INDEX[guess], candidates), strict=True)
+        if s == score
+    ]
+
+
+def best_guess(candidates: list[int]) -> str:
+    """Pick the guess with the most expected information about the candidates.
+
+    Every code is tried as a guess, the one whose scores split the candidates into the most
+    even groups wins, a candidate being preferred on ties since it could be the answer.
+
+    Args:
+        candidates (list[int]): Indexes in `CODES`, there must be at least one.
+
+    Returns:
+        str: The code to guess.
+    """
+    if len(candidates) <= 2:
+        return CODES[candidates[0]]
+    if len(candidates) == _size:
+        # every first guess is as good as another
+        return CODES[random.choice(candidates)]
+
+    possible = set(candidates)
+    best, best_cost = candidates[0], math.inf
+    for guess in range(_size):
+        # minimizing sum(n log n) over the groups maximizes their entropy
+        cost = sum(n * math.log(n) for n in Counter(_scores(guess, candidates)).values())
+        if guess not in possible:
+            cost += 1e-9
+        if cost < best_cost:
+            best, best_cost = guess, cost
+    return CODES[best]
@@ -0,0 +1,268 @@
+from typing import TYPE_CHECKING
+
+from attrs import define, field
+from loguru import logger
+
+from utility.utils import get_dt_now
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    import asyncpg
+
+LedgerEntry = tuple[int | None, int | None, int, str | None]
+"""(src, dst, amount, reason) of a transfer, None being the bank."""
+
+_BANK_QUERY = """
+    SELECT s.bank + (
+        SELECT COALESCE(SUM(l.amount) FILTER (WHERE l.dst IS NULL), 0)
+             - COALESCE(SUM(l.amount) FILTER (WHERE l.src IS NULL), 0)
+        FROM flow_ledger l
+        WHERE l.id > s.ledger_id
+    )
+    FROM flow_snapshots s
+    ORDER BY s.ledger_id DESC
+    LIMIT 1
+"""
+
+
+@define
+class Summary:
+    accounts: int
+    supply: int
+    """Flow held by users."""
+    bank: int
+
+    @property
+    def total(self) -> int:
+        return self.supply + self.bank
+
+
+@define
+class LedgerReport:
+    total: int
+    """bank + accounts of the first snapshot, which every later state has to add up to."""
+    bank: int
+    """The bank's balance, replayed from the first snapshot and every entry after it."""
+    accounts: int
+    """The sum of every account, replayed the same way."""
+    actual_accounts: int
+    """SUM(flow) of flow_accounts."""
+    entries: int
+    broken_snapshots: list[int] = field(factory=list)
+    """Ledger IDs of the snapshots whose bank + accounts isn't `total`."""
+
+    @property
+    def ok(self) -> bool:
+        return (
+            self.accounts == self.actual_accounts
+            and self.bank + self.accounts == self.total
+            and not self.broken_snapshots
+        )
+
+
+async def setup_ledger_schema(pool: "asyncpg.Pool") -> None:
+    """Create the ledger tables, and the first snapshot from the bank row if there is none.
+
+    Args:
+        pool (asyncpg.Pool): The database pool.
+    """
+    await pool.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flow_ledger (
+            id BIGSERIAL PRIMARY KEY,
+            src BIGINT,
+            dst BIGINT,
+            amount INT NOT NULL,
+            reason TEXT,
+            time TIMESTAMP NOT NULL
+        )
+        """
+    )
+    await pool.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flow_snapshots (
+            ledger_id BIGINT PRIMARY KEY,
+            bank BIGINT NOT NULL,
+            accounts BIGINT NOT NULL,
+            time TIMESTAMP NOT NULL
+        )
+        """
+    )
+    await pool.execute(
+        """
+        INSERT INTO flow_snapshots (ledger_id, bank, accounts, time)
+        SELECT
+            (SELECT COALESCE(MAX(id), 0) FROM flow_ledger),
+            (SELECT flow FROM bank),
+            (SELECT COALESCE(SUM(flow), 0) FROM flow_accounts),
+            $1
+        WHERE NOT EXISTS (SELECT 1 FROM flow_snapshots)
+        """,
+        get_dt_now(),
+    )
+    # the totals are derived from the snapshots now, the row every write used to update is gone
+    await pool.execute("DROP TABLE IF EXISTS flow_summary")
+
+
+async def record(conn: "asyncpg.Connection", entries: "Iterable[LedgerEntry]") -> None:
+    """Append entries to the ledger with COPY, use it inside the transaction that moved the flow.
+
+    Args:
+        conn (asyncpg.Connection): The connection of the transaction.
+        entries (Iterable[LedgerEntry]): The transfers to record.
+    """
+    now = get_dt_now()
+    records = [(*entry, now) for entry in entries]
+    if records:
+        await conn.copy_records_to_table(
+            "flow_ledger", records=records, columns=("src", "dst", "amount", "reason", "time")
+        )
+
+
+async def get_bank(conn: "asyncpg.Pool | asyncpg.Connection") -> int:
+    """Derive the bank's balance from the latest snapshot and the entries after it.
+
+    Args:
+        conn (asyncpg.Pool | asyncpg.Connection): The database pool or a connection.
+
+    Returns:
+        int: The amount of flow in the bank.
+    """
+    return await conn.fetchval(_BANK_QUERY)
+
+
+async def take_snapshot(pool: "asyncpg.Pool") -> None:
+    """Record the current bank and account totals, so the bank is derived from fewer entries.
+
+    The legacy `bank` row is updated to the derived balance as well.
+
+    Args:
+        pool (asyncpg.Pool): The database pool.
+    """
+    async with pool.acquire() as conn, conn.transaction():
+        # waits for in-flight transfers and keeps new ones out, so that every entry up to
+        # ledger_id is committed and none after it is included in the account sum
+        await conn.execute("LOCK TABLE flow_ledger IN SHARE MODE")
+        bank = await get_bank(conn)
+        row = await conn.fetchrow(
+            """
+            INSERT INTO flow_snapshots (ledger_id, bank, accounts, time)
+            SELECT
+                (SELECT COALESCE(MAX(id), 0) FROM flow_ledger),
+                $1,
+                (SELECT COALESCE(SUM(flow), 0) FROM flow_accounts),
+                $2
+            ON CONFLICT (ledger_id) DO NOTHING
+            RETURNING ledger_id, accounts
+            """,
+            bank,
+            get_dt_now(),
+        )
+        await conn.execute("UPDATE bank SET flow = $1", bank)
+    if row is not None:
+        logger.info(
+            f"Flow snapshot at ledger {row['ledger_id']}: bank {bank}, accounts {row['accounts']}"
+        )
+
+
+async def verify_ledger(pool: "asyncpg.Pool") -> LedgerReport:
+    """Replay the whole ledger from the first snapshot and check that no flow was made or lost.
+
+    Args:
+        pool (asyncpg.Pool): The database pool.
+
+    Returns:
+        LedgerReport: The replayed totals.
+    """
+    async with pool.acquire() as conn, conn.transaction():
+        await conn.execute("LOCK TABLE flow_ledger IN SHARE MODE")
+        snapshots = await conn.fetch(
+            "SELECT ledger_id, bank, accounts FROM flow_snapshots ORDER BY ledger_id"
+        )
+        first = snapshots[0]
+        replay = await conn.fetchrow(
+            """
+            SELECT
+                COUNT(*) AS entries,
+                COALESCE(SUM(amount) FILTER (WHERE dst IS NULL), 0) AS to_bank,
+                COALESCE(SUM(amount) FILTER (WHERE src IS NULL), 0) AS from_bank,
+                COALESCE(SUM(amount) FILTER (WHERE dst IS NOT NULL), 0) AS to_accounts,
+                COALESCE(SUM(amount) FILTER (WHERE src IS NOT NULL), 0) AS from_accounts
+            FROM flow_ledger
+            WHERE id > $1
+            """,
+            first["ledger_id"],
+        )
+        actual_accounts = await conn.fetchval("SELECT COALESCE(SUM(flow), 0) FROM flow_accounts")
+
+    assert replay is not None
+    total = first["bank"] + first["accounts"]
+    return LedgerReport(
+        total=total,
+        bank=first["bank"] + replay["to_bank"] - replay["from_bank"],
+        accounts=first["accounts"] + replay["to_accounts"] - replay["from_accounts"],
+        actual_accounts=actual_accounts,
+        entries=replay["entries"],
+        broken_snapshots=[s["ledger_id"] for s in snapshots if s["bank"] + s["accounts"] != total],
+    )
+
+
+_SUMMARY_QUERY = """
+    SELECT
+        (SELECT COUNT(*) FROM flow_accounts) AS accounts,
+        s.accounts
+            + COALESCE(SUM(l.amount) FILTER (WHERE l.dst IS NOT NULL), 0)
+            - COALESCE(SUM(l.amount) FILTER (WHERE l.src IS NOT NULL), 0) AS supply,
+        s.bank
+            + COALESCE(SUM(l.amount) FILTER (WHERE l.dst IS NULL), 0)
+            - COALESCE(SUM(l.amount) FILTER (WHERE l.src IS NULL), 0) AS bank
+    FROM (SELECT * FROM flow_snapshots ORDER BY ledger_id DESC LIMIT 1) s
+    LEFT JOIN flow_ledger l ON l.id > s.ledger_id
+    GROUP BY s.ledger_id, s.accounts, s.bank
+"""
+
+
+async def get_summary(pool: "asyncpg.Pool | asyncpg.Connection") -> Summary:
+    """Get the account count, circulating supply and bank balance.
+
+    Supply and bank are derived from the latest snapshot and the entries after it, so no
+    write path has to update a shared row for them.
+
+    Args:
+        pool (asyncpg.Pool | asyncpg.Connection): The database pool or a connection.
+
+    Returns:
+        Summary: The economy summary.
+    """
+    row = await pool.fetchrow(_SUMMARY_QUERY)
+    assert row is not None
+    return Summary(**row)
+
+
+async def check_summary(pool: "asyncpg.Pool") -> tuple[Summary, Summary]:
+    """Compare the summary derived from the ledger with the accounts themselves.
+
+    Args:
+        pool (asyncpg.Pool): The database pool.
+
+    Returns:
+        tuple[Summary, Summary]: The derived summary, and the one recomputed from flow_accounts
+            and the total of the first snapshot.
+    """
+    async with pool.acquire() as conn, conn.transaction():
+        # keeps transfers out so the ledger and the accounts are read at the same point
+        await conn.execute("LOCK TABLE flow_ledger IN SHARE MODE")
+        derived = await get_summary(conn)
+        actual = await conn.fetchrow(
+            """
+            SELECT
+                COUNT(*) AS accounts,
+                COALESCE(SUM(flow), 0) AS supply,
+                (SELECT bank + accounts FROM flow_snapshots ORDER BY ledger_id LIMIT 1)
+                    - COALESCE(SUM(flow), 0) AS bank
+            FROM flow_accounts
+            """
+        )
+    assert actual is not None
+    return derived, Summary(**actual)
@@ -0,0 +1,5 @@
+from .cache import *
+from .curve import *
+from .leaderboard import *
+from .schema import *
+from .voice import *
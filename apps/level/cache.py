@@ -0,0 +1,152 @@
+import asyncio
+from typing import TYPE_CHECKING
+
+from attrs import define
+from loguru import logger
+
+from utility.utils import get_dt_now
+
+if TYPE_CHECKING:
+    import datetime
+
+    import asyncpg
+
+COOLDOWN = 30
+"""Seconds a member has to wait between two chat XP grants."""
+DAILY_CAP = 400
+"""Maximum amount of chat XP a member can earn in a day."""
+IDLE_TTL = 3600
+"""Seconds of inactivity after which a flushed entry is dropped from the cache."""
+
+
+@define
+class LevelState:
+    chat_xp: int
+    today_earn: int
+    earn_date: "datetime.date | None"
+    last_get: "datetime.datetime"
+    notif: bool
+    last_seen: "datetime.datetime"
+    """When the member last chatted, granted or not, used to evict idle entries."""
+    pending: int = 0
+
+
+class XPCache:
+    """Write-behind cache of chat XP, keyed by (guild_id, user_id).
+
+    Cooldown and daily cap are checked against the cached state, changes are
+    written back in one batched statement by `flush`.
+    """
+
+    def __init__(self, pool: "asyncpg.Pool") -> None:
+        self.pool = pool
+        self._states: dict[tuple[int, int], LevelState] = {}
+        self._lock = asyncio.Lock()
+
+    def get(self, guild_id: int, user_id: int) -> LevelState | None:
+        return self._states.get((guild_id, user_id))
+
+    def seed(self, guild_id: int, user_id: int, row: "asyncpg.Record") -> LevelState:
+        """Cache a member's state from a `levels` row.
+
+        Args:
+            guild_id (int): The guild's ID.
+            user_id (int): The user's ID.
+            row (asyncpg.Record): Row with chat_xp, today_earn, earn_date, last_get and notif.
+
+        Returns:
+            LevelState: The cached state.
+        """
+        state = LevelState(
+            chat_xp=row["chat_xp"],
+            today_earn=row["today_earn"],
+            earn_date=row["earn_date"],
+            last_get=row["last_get"],
+            notif=row["notif"],
+            last_seen=get_dt_now(),
+        )
+        self._states[guild_id, user_id] = state
+        return state
+
+    def add_xp(
+        self, state: LevelState, xp: int, now: "datetime.datetime"
+    ) -> tuple[int, int] | None:
+        """Add chat XP to a cached state if the cooldown and daily cap allow it.
+
+        A today_earn stamped with an earlier day counts as zero.
+
+        Args:
+            state (LevelState): The cached state.
+            xp (int): The amount of XP to add.
+            now (datetime.datetime): The current time.
+
+        Returns:
+            tuple[int, int] | None: XP before and after the grant, None if nothing was granted.
+        """
+        state.last_seen = now
+        if state.earn_date != now.date():
+            state.today_earn = 0
+            state.earn_date = now.date()
+        if (now - state.last_get).total_seconds() < COOLDOWN or state.today_earn >= DAILY_CAP:
+            return None
+
+        before = state.chat_xp
+        state.chat_xp += xp
+        state.today_earn += xp
+        state.pending += xp
+        state.last_get = now
+        return before, state.chat_xp
+
+    def set_notif(self, guild_id: int, user_id: int, notif: bool) -> None:
+        state = self._states.get((guild_id, user_id))
+        if state is not None:
+            state.notif = notif
+
+    async def flush(self) -> None:
+        """Write all pending XP deltas to the database in one statement."""
+        async with self._lock:
+            keys = [key for key, state in self._states.items() if state.pending]
+            if keys:
+                states = [self._states[key] for key in keys]
+                deltas = [state.pending for state in states]
+                for state in states:
+                    state.pending = 0
+
+                try:
+                    await self.pool.execute(
+                        """
+                        UPDATE levels
+                        SET chat_xp = levels.chat_xp + d.xp,
+                            today_earn = d.today_earn,
+                            earn_date = d.earn_date,
+                            last_get = d.last_get
+                        FROM unnest(
+                            $1::bigint[], $2::bigint[], $3::int[], $4::int[], $5::date[], $6::timestamp[]
+                        ) AS d(guild_id, user_id, xp, today_earn, earn_date, last_get)
+                        WHERE levels.guild_id = d.guild_id AND levels.user_id = d.user_id
+                        """,
+                        [key[0] for key in keys],
+                        [key[1] for key in keys],
+                        deltas,
+                        [state.today_earn for state in states],
+                        [state.earn_date for state in states],
+                        [state.last_get for state in states],
+                    )
+                except Exception:
+                    # keep the deltas so the next flush retries them
+                    for state, delta in zip(states, deltas, strict=True):
+                        state.pending += delta
+                    raise
+                logger.debug(f"Flushed chat XP for {len(keys)} members")
+
+            self._evict_idle()
+
+    def _evict_idle(self) -> None:
+        now = get_dt_now()
+        idle = [
+            key
+            for key, state in self._states.items()
+            if not state.pending and (now - state.last_seen).total_seconds() > IDLE_TTL
+        ]
+        for key in idle:
+            del self._states[key]
@@ -0,0 +1,66 @@
+from bisect import bisect_right
+from typing import TYPE_CHECKING
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+BASE_XP = 100
+"""XP required to reach level 1."""
+MAX_LEVEL = 64
+"""Highest level in the precomputed table, far above any reachable XP."""
+
+
+def _threshold(level: int) -> int:
+    """Smallest integer XP that satisfies xp >= 100 * 1.5 ** (level - 1), computed exactly."""
+    return -(-BASE_XP * 3 ** (level - 1) // 2 ** (level - 1))
+
+
+THRESHOLDS: tuple[int, ...] = tuple(_threshold(level) for level in range(1, MAX_LEVEL + 1))
+"""THRESHOLDS[n] is the XP required to reach level n + 1."""
+
+_np_thresholds = np.array(THRESHOLDS, dtype=np.int64) if np is not None else None
+
+
+def get_level(xp: int) -> int:
+    """Get the level for an amount of XP.
+
+    Args:
+        xp (int): The amount of XP.
+
+    Returns:
+        int: The level, 0 if the XP is below the first threshold.
+    """
+    return bisect_right(THRESHOLDS, xp)
+
+
+def get_levels(xps: "Sequence[int]") -> list[int]:
+    """Get the levels for many amounts of XP in one pass.
+
+    Args:
+        xps (Sequence[int]): The amounts of XP.
+
+    Returns:
+        list[int]: The levels, in the same order as `xps`.
+    """
+    if _np_thresholds is not None:
+        return np.searchsorted(_np_thresholds, xps, side="right").tolist()
+    return [bisect_right(THRESHOLDS, xp) for xp in xps]
+
+
+def get_xp_required(level: int) -> int:
+    """Get the XP required to reach a level.
+
+    Args:
+        level (int): The level, starting from 1.
+
+    Returns:
+        int: The XP required.
+    """
+    if level <= MAX_LEVEL:
+        return THRESHOLDS[level - 1]
+    return _threshold(level)
@@ -0,0 +1,92 @@
+from collections import defaultdict
+from typing import TYPE_CHECKING, Literal
+
+from utility.rank import RankIndex
+
+if TYPE_CHECKING:
+    import asyncpg
+
+XPColumn = Literal["chat_xp", "voice_xp"]
+PAGE_SIZE = 10
+
+
+async def get_ranked_count(guild_id: int, pool: "asyncpg.Pool") -> int:
+    """Get the number of members on a guild's leaderboard.
+
+    Args:
+        guild_id (int): The guild's ID.
+        pool (asyncpg.Pool): The database pool.
+
+    Returns:
+        int: The number of members.
+    """
+    return await pool.fetchval("SELECT COUNT(*) FROM levels WHERE guild_id = $1", guild_id)
+
+
+async def load_rank_indexes(pool: "asyncpg.Pool") -> dict[tuple[int, XPColumn], RankIndex]:
+    """Build the rank index of every guild and XP column from one query.
+
+    Args:
+        pool (asyncpg.Pool): The database pool.
+
+    Returns:
+        dict[tuple[int, XPColumn], RankIndex]: Rank indexes keyed by (guild_id, column).
+    """
+    rows = await pool.fetch("SELECT guild_id, user_id, chat_xp, voice_xp FROM levels")
+    scores: defaultdict[tuple[int, XPColumn], dict[int, int]] = defaultdict(dict)
+    for row in rows:
+        scores[row["guild_id"], "chat_xp"][row["user_id"]] = row["chat_xp"]
+        scores[row["guild_id"], "voice_xp"][row["user_id"]] = row["voice_xp"]
+
+    indexes: dict[tuple[int, XPColumn], RankIndex] = {}
+    for key, guild_scores in scores.items():
+        indexes[key] = RankIndex()
+        indexes[key].load(guild_scores)
+    return indexes
+
+
+async def get_leaderboard_page(
+    guild_id: int,
+    column: XPColumn,
+    pool: "asyncpg.Pool",
+    *,
+    cursor: tuple[int, int] | None = None,
+    reverse: bool = False,
+    limit: int = PAGE_SIZE,
+) -> list["asyncpg.Record"]:
+    """Get one page of a guild's leaderboard with keyset pagination.
+
+    Rows are always returned best first, each with user_id, xp and rank.
+
+    Args:
+        guild_id (int): The guild's ID.
+        column (XPColumn): The XP column to rank by.
+        pool (asyncpg.Pool): The database pool.
+        cursor (tuple[int, int] | None): (xp, user_id) of the row next to the page, None to start from the top (or the bottom if reverse).
+        reverse (bool): Fetch the rows ranked above the cursor instead of below it.
+        limit (int): The page size.
+
+    Returns:
+        list[asyncpg.Record]: The rows of the page.
+    """
+    op, order = (">", "ASC") if reverse else ("<", "DESC")
+    keyset = f"AND ({column}, user_id) {op} ($3, $4)" if cursor is not None else ""
+    return await pool.fetch(
+        f"""
+        SELECT p.user_id, p.xp, (
+            SELECT COUNT(*) FROM levels AS l
+            WHERE l.guild_id = $1 AND l.{column} > p.xp
+        ) + 1 AS rank
+        FROM (
+            SELECT user_id, {column} AS xp
+            FROM levels
+            WHERE guild_id = $1 {keyset}
+            ORDER BY {column} {order}, user_id {order}
+            LIMIT $2
+        ) AS p
+        ORDER BY p.xp DESC, p.user_id DESC
+        """,
+        guild_id,
+        limit,
+        *(cursor or ()),
+    )
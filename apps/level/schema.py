@@ -0,0 +1,18 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import asyncpg
+
+
+async def setup_level_schema(pool: "asyncpg.Pool") -> None:
+    """Add the columns and indexes the level system relies on to existing tables.
+
+    Args:
+        pool (asyncpg.Pool): The database pool.
+    """
+    # today_earn only counts for the day in earn_date, so it never needs a nightly reset
+    await pool.execute("ALTER TABLE levels ADD COLUMN IF NOT EXISTS earn_date DATE")
+    for column in ("chat_xp", "voice_xp"):
+        await pool.execute(
+            f"CREATE INDEX IF NOT EXISTS levels_guild_id_{column}_idx ON levels (guild_id, {column}, user_id)"
+        )
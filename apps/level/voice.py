@@ -0,0 +1,213 @@
+import asyncio
+import datetime
+from typing import TYPE_CHECKING
+
+from attrs import define
+from loguru import logger
+
+from utility.utils import get_dt_now
+
+if TYPE_CHECKING:
+    import asyncpg
+    import discord
+
+
+VOICE_XP_UNIT = 300
+"""Seconds in voice that are worth 1 voice XP."""
+
+
+@define
+class VoiceSession:
+    channel_id: int
+    since: datetime.datetime
+    """Start of the time in voice that has not been credited yet."""
+
+
+class VoiceSessions:
+    """In-memory table of open voice sessions, keyed by (guild_id, user_id).
+
+    XP is credited in whole units by `credit`, sessions are written to the `voice_xp` table by
+    `checkpoint` so they survive a restart.
+    """
+
+    def __init__(self, pool: "asyncpg.Pool") -> None:
+        self.pool = pool
+        self._sessions: dict[tuple[int, int], VoiceSession] = {}
+        self._closed: set[tuple[int, int]] = set()
+        self._owed: dict[tuple[int, int], int] = {}
+        self._lock = asyncio.Lock()
+
+    def open(
+        self,
+        member: "discord.Member",
+        channel: "discord.VoiceChannel | discord.StageChannel",
+        now: datetime.datetime,
+    ) -> None:
+        key = (member.guild.id, member.id)
+        session = self._sessions.get(key)
+        if session is not None:
+            # switching channels keeps the uncredited time
+            session.channel_id = channel.id
+            return
+        self._sessions[key] = VoiceSession(channel_id=channel.id, since=now)
+        self._closed.discard(key)
+
+    def close(self, member: "discord.Member", now: datetime.datetime) -> None:
+        """End a session, its remaining whole units are credited on the next `credit`."""
+        key = (member.guild.id, member.id)
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return
+
+        self._closed.add(key)
+        units = int((now - session.since).total_seconds()) // VOICE_XP_UNIT
+        if units > 0:
+            self._owed[key] = self._owed.get(key, 0) + units
+
+    def _accrue(self, now: datetime.datetime) -> dict[tuple[int, int], int]:
+        owed, self._owed = self._owed, {}
+        for key, session in self._sessions.items():
+            units = int((now - session.since).total_seconds()) // VOICE_XP_UNIT
+            if units > 0:
+                session.since += datetime.timedelta(seconds=units * VOICE_XP_UNIT)
+                owed[key] = owed.get(key, 0) + units
+        return owed
+
+    async def credit(self, now: datetime.datetime) -> list[tuple[int, int, int, int, bool]]:
+        """Credit the accrued voice XP of every session in one transaction.
+
+        The new accrual start of the credited sessions is checkpointed in the same transaction,
+        so a restart can never credit the same time twice.
+
+        Args:
+            now (datetime.datetime): The current time.
+
+        Returns:
+            list[tuple[int, int, int, int, bool]]: guild_id, user_id, XP before, XP after and the
+                notif setting of every member that got XP.
+        """
+        async with self._lock:
+            owed = self._accrue(now)
+            if not owed:
+                return []
+
+            keys = list(owed)
+            open_keys = [key for key in keys if key in self._sessions]
+            try:
+                async with self.pool.acquire() as conn, conn.transaction():
+                    rows = await conn.fetch(
+                        """
+                        INSERT INTO levels AS l (guild_id, user_id, start_date, last_get, voice_xp)
+                        SELECT d.guild_id, d.user_id, $4, $4, d.xp
+                        FROM unnest($1::bigint[], $2::bigint[], $3::int[]) AS d(guild_id, user_id, xp)
+                        ON CONFLICT (user_id, guild_id) DO UPDATE
+                        SET voice_xp = l.voice_xp + EXCLUDED.voice_xp
+                        RETURNING l.guild_id, l.user_id, l.voice_xp, l.notif
+                        """,
+                        [key[0] for key in keys],
+                        [key[1] for key in keys],
+                        [owed[key] for key in keys],
+                        now,
+                    )
+                    await self._upsert_sessions(conn, open_keys)
+            except Exception:
+                # credit them again on the next tick
+                for key, units in owed.items():
+                    self._owed[key] = self._owed.get(key, 0) + units
+                raise
+
+        return [
+            (
+                row["guild_id"],
+                row["user_id"],
+                row["voice_xp"] - owed[row["guild_id"], row["user_id"]],
+                row["voice_xp"],
+                row["notif"],
+            )
+            for row in rows
+        ]
+
+    async def _upsert_sessions(
+        self, conn: "asyncpg.Connection", keys: list[tuple[int, int]]
+    ) -> None:
+        sessions = [self._sessions[key] for key in keys]
+        await conn.execute(
+            """
+            INSERT INTO voice_xp (guild_id, user_id, joined_at, channel_id)
+            SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::timestamp[], $4::bigint[])
+            ON CONFLICT (user_id, guild_id) DO UPDATE
+            SET joined_at = EXCLUDED.joined_at, channel_id = EXCLUDED.channel_id
+            """,
+            [key[0] for key in keys],
+            [key[1] for key in keys],
+            [session.since for session in sessions],
+            [session.channel_id for session in sessions],
+        )
+
+    async def restore(self, guild: "discord.Guild") -> None:
+        """Rebuild the sessions of a guild from its current voice states.
+
+        Members still in the channel they were checkpointed in keep their uncredited time,
+        everyone else starts a new session now. Sessions opened since the bot connected are
+        kept as they are.
+
+        Args:
+            guild (discord.Guild): The guild.
+        """
+        rows = await self.pool.fetch(
+            """
+            SELECT user_id, joined_at, channel_id
+            FROM voice_xp
+            WHERE guild_id = $1 AND joined_at IS NOT NULL
+            """,
+            guild.id,
+        )
+        checkpoints = {row["user_id"]: row for row in rows}
+        now = get_dt_now()
+        restored = 0
+
+        for channel in (*guild.voice_channels, *guild.stage_channels):
+            for user_id in channel.voice_states:
+                member = guild.get_member(user_id)
+                if member is None or member.bot:
+                    continue
+
+                row = checkpoints.pop(user_id, None)
+                if (guild.id, user_id) in self._sessions:
+                    continue
+                since = now
+                if row is not None and row["channel_id"] == channel.id:
+                    since = row["joined_at"]
+                self._sessions[guild.id, user_id] = VoiceSession(channel.id, since)
+                restored += 1
+
+        # members who left while the bot was offline
+        self._closed.update(
+            (guild.id, user_id)
+            for user_id in checkpoints
+            if (guild.id, user_id) not in self._sessions
+        )
+        logger.info(f"Restored {restored} voice sessions in {guild.name}")
+
+    async def checkpoint(self) -> None:
+        """Write all open sessions and clear closed ones in one transaction."""
+        async with self._lock:
+            closed = list(self._closed)
+            self._closed.clear()
+
+            try:
+                async with self.pool.acquire() as conn, conn.transaction():
+                    await self._upsert_sessions(conn, list(self._sessions))
+                    await conn.execute(
+                        """
+                        UPDATE voice_xp
+                        SET joined_at = NULL, channel_id = NULL
+                        FROM unnest($1::bigint[], $2::bigint[]) AS c(guild_id, user_id)
+                        WHERE voice_xp.guild_id = c.guild_id AND voice_xp.user_id = c.user_id
+                        """,
+                        [key[0] for key in closed],
+                        [key[1] for key in closed],
+                    )
+            except Exception:
+                self._closed.update(key for key in closed if key not in self._sessions)
+                raise
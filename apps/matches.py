@@ -0,0 +1,91 @@
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+from dev.model import ConnectFourMatch, GuessNumMatch
+
+if TYPE_CHECKING:
+    import asyncpg
+
+connect_four: dict[int, ConnectFourMatch] = {}
+"""Active connect four matches by thread ID."""
+guess_num: dict[int, GuessNumMatch] = {}
+"""Active guess number matches by thread ID, with both numbers set."""
+
+
+async def load_matches(pool: "asyncpg.Pool") -> None:
+    """Rebuild the active matches from the database.
+
+    Args:
+        pool (asyncpg.Pool): The database pool.
+    """
+    rows = await pool.fetch("SELECT * FROM connect_four")
+    connect_four.clear()
+    connect_four.update({row["channel_id"]: ConnectFourMatch.from_row(row) for row in rows})
+
+    rows = await pool.fetch(
+        "SELECT * FROM guess_num WHERE player_one_num IS NOT NULL AND player_two_num IS NOT NULL"
+    )
+    guess_num.clear()
+    guess_num.update({row["channel_id"]: GuessNumMatch.from_row(row) for row in rows})
+    logger.info(f"Loaded {len(connect_four)} connect four and {len(guess_num)} guess num matches")
+
+
+async def start_connect_four(thread_id: int, board_link: str, pool: "asyncpg.Pool") -> None:
+    """Save a new connect four match.
+
+    Args:
+        thread_id (int): ID of the match's thread.
+        board_link (str): Jump URL of the board message.
+        pool (asyncpg.Pool): The database pool.
+    """
+    await pool.execute(
+        "INSERT INTO connect_four (channel_id, board_link) VALUES ($1, $2)", thread_id, board_link
+    )
+    connect_four[thread_id] = ConnectFourMatch(channel_id=thread_id, board_link=board_link)
+
+
+async def end_connect_four(thread_id: int, pool: "asyncpg.Pool") -> None:
+    """Remove a connect four match that ended.
+
+    Args:
+        thread_id (int): ID of the match's thread.
+        pool (asyncpg.Pool): The database pool.
+    """
+    connect_four.pop(thread_id, None)
+    await pool.execute("DELETE FROM connect_four WHERE channel_id = $1", thread_id)
+
+
+async def start_guess_num(match: GuessNumMatch, pool: "asyncpg.Pool") -> None:
+    """Save a new guess number match, once both players set their numbers.
+
+    Args:
+        match (GuessNumMatch): The match.
+        pool (asyncpg.Pool): The database pool.
+    """
+    await pool.execute(
+        """
+        INSERT INTO guess_num
+        (channel_id, player_one, player_two,
+        flow, player_one_num, player_two_num)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        """,
+        match.channel_id,
+        match.p1,
+        match.p2,
+        match.flow,
+        match.p1_num,
+        match.p2_num,
+    )
+    guess_num[match.channel_id] = match
+
+
+async def end_guess_num(thread_id: int, pool: "asyncpg.Pool") -> None:
+    """Remove a guess number match that ended.
+
+    Args:
+        thread_id (int): ID of the match's thread.
+        pool (asyncpg.Pool): The database pool.
+    """
+    guess_num.pop(thread_id, None)
+    await pool.execute("DELETE FROM guess_num WHERE channel_id = $1", thread_id)
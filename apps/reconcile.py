@@ -0,0 +1,109 @@
+from typing import TYPE_CHECKING
+
+from attrs import define, field
+from loguru import logger
+
+from apps import ledger
+
+if TYPE_CHECKING:
+    import asyncpg
+
+
+@define
+class Departed:
+    """User IDs that have rows in a table but are no longer members of the guild."""
+
+    levels: set[int] = field(factory=set)
+    voice: set[int] = field(factory=set)
+    flow: set[int] = field(factory=set)
+    refunded: int = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.levels or self.voice or self.flow)
+
+
+async def _stale_ids(
+    query: str, member_ids: list[int], pool: "asyncpg.Pool", *args: object
+) -> set[int]:
+    rows = await pool.fetch(query, member_ids, *args)
+    return {row["user_id"] for row in rows}
+
+
+async def find_departed(
+    guild_id: int, member_ids: set[int], pool: "asyncpg.Pool", *, flow: bool = False
+) -> Departed:
+    """Diff the guild's members against the user IDs stored for it, one query per table.
+
+    Args:
+        guild_id (int): The guild's ID.
+        member_ids (set[int]): IDs of everyone currently in the guild.
+        pool (asyncpg.Pool): The database pool.
+        flow (bool): Whether flow accounts belong to this guild and should be checked too.
+
+    Returns:
+        Departed: The stale user IDs of each table, none if `member_ids` is empty.
+    """
+    if not member_ids:
+        # the bot itself is a member, so the member list failed to load, not everyone left
+        logger.warning(f"No members given for {guild_id}, skipping the departed check")
+        return Departed()
+
+    ids = list(member_ids)
+    departed = Departed(
+        levels=await _stale_ids(
+            "SELECT user_id FROM levels WHERE guild_id = $2 AND NOT user_id = ANY($1::bigint[])",
+            ids,
+            pool,
+            guild_id,
+        ),
+        voice=await _stale_ids(
+            "SELECT user_id FROM voice_xp WHERE guild_id = $2 AND NOT user_id = ANY($1::bigint[])",
+            ids,
+            pool,
+            guild_id,
+        ),
+    )
+    if flow:
+        departed.flow = await _stale_ids(
+            "SELECT user_id FROM flow_accounts WHERE NOT user_id = ANY($1::bigint[])", ids, pool
+        )
+    return departed
+
+
+async def purge_departed(guild_id: int, departed: Departed, pool: "asyncpg.Pool") -> None:
+    """Delete the rows of departed users in one transaction, returning their flow to the bank.
+
+    `departed.refunded` is set to the amount of flow given back to the bank.
+
+    Args:
+        guild_id (int): The guild's ID.
+        departed (Departed): The result of `find_departed`.
+        pool (asyncpg.Pool): The database pool.
+    """
+    if not departed:
+        return
+
+    async with pool.acquire() as conn, conn.transaction():
+        await conn.execute(
+            "DELETE FROM levels WHERE guild_id = $1 AND user_id = ANY($2::bigint[])",
+            guild_id,
+            list(departed.levels),
+        )
+        await conn.execute(
+            "DELETE FROM voice_xp WHERE guild_id = $1 AND user_id = ANY($2::bigint[])",
+            guild_id,
+            list(departed.voice),
+        )
+        gone = await conn.fetch(
+            "DELETE FROM flow_accounts WHERE user_id = ANY($1::bigint[]) RETURNING user_id, flow",
+            list(departed.flow),
+        )
+        departed.refunded = sum(row["flow"] for row in gone)
+        await ledger.record(
+            conn, [(row["user_id"], None, row["flow"], "departed") for row in gone if row["flow"]]
+        )
+    logger.info(
+        f"Purged departed users of {guild_id}: {len(departed.levels)} levels, "
+        f"{len(departed.voice)} voice sessions, {len(departed.flow)} flow accounts "
+        f"({departed.refunded} flow refunded)"
+    )
@@ -5,6 +5,7 @@ from typing import TYPE_CHECKING
 import discord
 from discord.ext import commands
 
+from apps.ledger import check_summary, verify_ledger
 from utility.utils import error_embed
 
 if TYPE_CHECKING:
@@ -96,6 +97,35 @@ class AdminCog(commands.Cog):
         )
         await ctx.message.delete()
 
+    @commands.is_owner()
+    @commands.command(name="routes")
+    async def routes(self, ctx: commands.Context) -> None:
+        lines = [
+            f"{r.name}: {r.stats.calls} calls, {r.stats.errors} errors, "
+            f"avg {r.stats.avg_time * 1000:.1f}ms, max {r.stats.max_time * 1000:.1f}ms"
+            for r in sorted(
+                self.bot.router.routes.values(), key=lambda r: r.stats.total_time, reverse=True
+            )
+        ]
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+    @commands.is_owner()
+    @commands.command(name="ledger")
+    async def ledger(self, ctx: commands.Context) -> None:
+        report = await verify_ledger(self.bot.pool)
+        lines = [
+            f"Replayed {report.entries} entries: bank {report.bank} + accounts {report.accounts}"
+            f" = {report.bank + report.accounts} (expected {report.total})",
+            f"flow_accounts sum: {report.actual_accounts}",
+        ]
+        if report.broken_snapshots:
+            lines.append(f"Broken snapshots: {report.broken_snapshots}")
+        derived, actual = await check_summary(self.bot.pool)
+        if derived != actual:
+            lines.append(f"Summary drift: derived {derived}, recomputed {actual}")
+        lines.append("OK" if report.ok and derived == actual else "MISMATCH")
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
 
 async def setup(bot: commands.Bot) -> None:
     await bot.add_cog(AdminCog(bot))
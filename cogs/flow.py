@@ -3,51 +3,42 @@ from random import randint
 
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
+from loguru import logger
 from seria.utils import split_list_to_chunks
 
 import apps.flow as flow_app
+from apps import ledger
 from dev.enum import TimeType
 from dev.model import BotModel, DefaultEmbed, ErrorEmbed, Inter
 from utility.paginator import GeneralPaginator
 
+MORNING_KEYWORDS = ("早", "good morning", "gm", "morning")
+NOON_KEYWORDS = ("午", "good noon", "noon", "gn")
+NIGHT_KEYWORDS = ("晚", "good night", "good evening", "gn")
+
 
 def bao_check():
     async def predicate(inter: discord.Interaction) -> bool:
         i: Inter = inter  # type: ignore
-        member = i.namespace.member
-        if member is not None:
-            member: discord.Member
-            await flow_app.register_account(member.id, i.client.pool)
-            member_flow = await flow_app.get_balance(member.id, i.client.pool)
-            if member_flow <= 0:
+        member: discord.Member | None = i.namespace.member
+        users = [i.user] if member is None else [member, i.user]
+        balances = await flow_app.get_balances((u.id for u in users), i.client.pool)
+
+        for user in users:
+            if balances[user.id] <= 0:
                 await i.response.send_message(
                     embed=ErrorEmbed(
                         "錯誤",
                         f"""
-                        使用者 {member.mention} 的當前暴幣數量不足
-                        {member.mention} 的暴幣: {member_flow}
+                        使用者 {user.mention} 的當前暴幣數量不足
+                        {user.mention} 的暴幣: {balances[user.id]}
                         """,
                     ),
                     ephemeral=True,
                 )
                 return False
 
-        await flow_app.register_account(i.user.id, i.client.pool)
-        user_flow = await flow_app.get_balance(i.user.id, i.client.pool)
-        if user_flow <= 0:
-            await i.response.send_message(
-                embed=ErrorEmbed(
-                    "錯誤",
-                    f"""
-                    使用者 {i.user.mention} 的當前暴幣數量不足
-                    {i.user.mention} 的暴幣: {user_flow}
-                    """,
-                ),
-                ephemeral=True,
-            )
-            return False
-
         return True
 
     return app_commands.check(predicate)
@@ -58,35 +49,50 @@ class BaoCog(commands.GroupCog, name="bao"):
         self.bot: BotModel = bot
         self.debug = self.bot.debug
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message) -> None:
-        user_id = message.author.id
-        if message.author.bot:
-            return
+    async def cog_load(self) -> None:
+        await ledger.setup_ledger_schema(self.bot.pool)
+        await flow_app.load_accounts(self.bot.pool)
+        self.snapshot_ledger.start()
+        self.check_summary.start()
+        self.bot.router.register(
+            "bao.greeting",
+            self.on_greeting,
+            keywords=MORNING_KEYWORDS + NOON_KEYWORDS + NIGHT_KEYWORDS,
+            exclude=("早午晚",),
+        )
 
-        morning_keywords = ("早", "good morning", "gm", "morning")
-        noon_keywords = ("午", "good noon", "noon", "gn")
-        night_keywords = ("晚", "good night", "good evening", "gn")
+    async def cog_unload(self) -> None:
+        self.bot.router.unregister("bao.greeting")
+        self.snapshot_ledger.cancel()
+        self.check_summary.cancel()
 
-        content = message.content.lower()
+    @tasks.loop(hours=1)
+    async def snapshot_ledger(self) -> None:
+        await ledger.take_snapshot(self.bot.pool)
 
-        if "早午晚" in message.content:
-            return
+    @tasks.loop(minutes=30)
+    async def check_summary(self) -> None:
+        derived, actual = await ledger.check_summary(self.bot.pool)
+        if derived != actual:
+            logger.error(f"Flow summary drifted: derived {derived}, recomputed {actual}")
 
-        await flow_app.register_account(user_id, self.bot.pool)
-        if any(keyword in content for keyword in morning_keywords):
+    async def on_greeting(self, message: discord.Message, keywords: frozenset[str]) -> None:
+        user_id = message.author.id
+
+        # free_flow registers the account, so messages without a greeting never touch the database
+        if not keywords.isdisjoint(MORNING_KEYWORDS):
             start = time(0, 0, 0)
             end = time(11, 59, 59)
             gave = await flow_app.free_flow(user_id, start, end, TimeType.MORNING, self.bot.pool)
             if gave:
                 await message.add_reaction("<:morning:982608491426508810>")
-        elif any(keyword in content for keyword in noon_keywords):
+        elif not keywords.isdisjoint(NOON_KEYWORDS):
             start = time(12, 0, 0)
             end = time(16, 59, 59)
             gave = await flow_app.free_flow(user_id, start, end, TimeType.NOON, self.bot.pool)
             if gave:
                 await message.add_reaction("<:noon:982608493313929246>")
-        elif any(keyword in content for keyword in night_keywords):
+        elif not keywords.isdisjoint(NIGHT_KEYWORDS):
             start = time(17, 0, 0)
             end = time(23, 59, 59)
             gave = await flow_app.free_flow(user_id, start, end, TimeType.NIGHT, self.bot.pool)
@@ -103,14 +109,12 @@ class BaoCog(commands.GroupCog, name="bao"):
         success = randint(1, 2) == 1
         flow_num = randint(1, 3)
 
-        await flow_app.flow_transaction(
-            member.id, -flow_num if success else flow_num, self.bot.pool
-        )
-        await flow_app.flow_transaction(
-            i.user.id, flow_num if success else -flow_num, self.bot.pool
+        payer, payee = (member, i.user) if success else (i.user, member)
+        # bao_check only guarantees a positive balance, the payer may have less than flow_num
+        flow_num, flow_payer, flow_payee = await flow_app.settle(
+            payer.id, payee.id, flow_num, self.bot.pool, reason="poke"
         )
-        flow_member = await flow_app.get_balance(member.id, self.bot.pool)
-        flow_user = await flow_app.get_balance(i.user.id, self.bot.pool)
+        flow_user, flow_member = (flow_payee, flow_payer) if success else (flow_payer, flow_payee)
 
         if success:
             message = f"""
@@ -140,25 +144,22 @@ class BaoCog(commands.GroupCog, name="bao"):
         member: discord.Member,
         amount: app_commands.Range[int, 0],
     ):
-        flow_user = await flow_app.get_balance(i.user.id, self.bot.pool)
-        if flow_user < amount:
+        try:
+            flow_user, flow_member = await flow_app.transfer(
+                i.user.id, member.id, amount, self.bot.pool, reason="give"
+            )
+        except flow_app.InsufficientFlowError as e:
             return await i.response.send_message(
                 embed=ErrorEmbed(
                     "錯誤",
                     f"""
                     使用者 {i.user.mention} 的當前暴幣數量不足
-                    {i.user.mention} 的暴幣: {flow_user}
+                    {i.user.mention} 的暴幣: {e.balance}
                     """,
                 ),
                 ephemeral=True,
             )
 
-        await flow_app.flow_transaction(member.id, amount, self.bot.pool)
-        await flow_app.flow_transaction(i.user.id, -amount, self.bot.pool)
-
-        flow_member = await flow_app.get_balance(member.id, self.bot.pool)
-        flow_user = await flow_app.get_balance(i.user.id, self.bot.pool)
-
         message = f"""
         {i.user.mention} 給了 {member.mention} {amount} 暴幣
 
@@ -212,11 +213,16 @@ class BaoCog(commands.GroupCog, name="bao"):
         self,
         i: discord.Interaction,
         member: discord.Member,
-        flow: int,
+        flow: app_commands.Range[int, 1],
         private: int = 0,
     ) -> None:
-        await flow_app.register_account(member.id, self.bot.pool)
-        await flow_app.flow_transaction(member.id, -flow, self.bot.pool)
+        try:
+            await flow_app.flow_transaction(member.id, -flow, self.bot.pool, reason="take")
+        except flow_app.InsufficientFlowError as e:
+            return await i.response.send_message(
+                embed=ErrorEmbed("錯誤", f"{member.mention} 只有 {e.balance} 枚暴幣"),
+                ephemeral=True,
+            )
 
         embed = DefaultEmbed(
             "已成功施展「反」摩拉克斯的力量",
@@ -239,11 +245,10 @@ class BaoCog(commands.GroupCog, name="bao"):
         self,
         i: discord.Interaction,
         member: discord.Member,
-        flow: int,
+        flow: app_commands.Range[int, 1],
         private: int = 0,
     ) -> None:
-        await flow_app.register_account(member.id, self.bot.pool)
-        await flow_app.flow_transaction(member.id, flow, self.bot.pool)
+        await flow_app.flow_transaction(member.id, flow, self.bot.pool, reason="make")
 
         embed = DefaultEmbed(
             "已成功施展摩拉克斯的力量",
@@ -252,14 +257,53 @@ class BaoCog(commands.GroupCog, name="bao"):
         ephemeral = private == 1
         await i.response.send_message(embed=embed, ephemeral=ephemeral)
 
+    @app_commands.command(
+        name="role", description="從銀行轉出暴幣給某個身分組的所有成員, 負數則為拿取"
+    )
+    @app_commands.rename(role="身分組", flow="每人的暴幣數量", private="私人訊息")
+    @app_commands.describe(
+        flow="正數為給予, 負數為拿取 (暴幣不足的成員會被拿走全部的暴幣)",
+        private="是否要顯示給使用者看 (預設為是)",
+    )
+    @app_commands.choices(
+        private=[
+            app_commands.Choice(name="是", value=1),
+            app_commands.Choice(name="否", value=0),
+        ]
+    )
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def role(
+        self,
+        i: discord.Interaction,
+        role: discord.Role,
+        flow: int,
+        private: int = 0,
+    ) -> None:
+        members = [m for m in role.members if not m.bot]
+        applied = await flow_app.bulk_transfer(
+            ((m.id, flow) for m in members), self.bot.pool, clamp=True, reason="role"
+        )
+        total = sum(applied.values())
+
+        if flow >= 0:
+            embed = DefaultEmbed(
+                "已成功施展摩拉克斯的力量",
+                f"{i.user.mention} 給了 {role.mention} 的 {len(members)} 位成員各 {flow} 枚暴幣",
+            )
+        else:
+            embed = DefaultEmbed(
+                "已成功施展「反」摩拉克斯的力量",
+                f"{i.user.mention} 從 {role.mention} 的 {len(members)} 位成員的帳戶裡拿走了共 {-total} 枚暴幣",
+            )
+        ephemeral = private == 1
+        await i.response.send_message(embed=embed, ephemeral=ephemeral)
+
     @app_commands.command(name="total", description="查看目前群組帳號及銀行暴幣分配情況")
     async def total(self, i: discord.Interaction) -> None:
-        bank = await flow_app.get_bank(self.bot.pool)
-        acc_count = await self.bot.pool.fetchval("SELECT COUNT(*) FROM flow_accounts")
-        flow_sum = await self.bot.pool.fetchval("SELECT SUM(flow) FROM flow_accounts")
+        summary = await ledger.get_summary(self.bot.pool)
         embed = DefaultEmbed(
-            f"目前共 {acc_count} 個 暴幣帳號",
-            f"用戶 {flow_sum} + 銀行 {bank} = {flow_sum + bank} 枚暴幣",
+            f"目前共 {summary.accounts} 個 暴幣帳號",
+            f"用戶 {summary.supply} + 銀行 {summary.bank} = {summary.total} 枚暴幣",
         )
         await i.response.send_message(embed=embed)
 
@@ -271,24 +315,21 @@ class BaoCog(commands.GroupCog, name="bao"):
         rows = await i.client.pool.fetch(
             "SELECT user_id, flow FROM flow_accounts ORDER BY flow DESC"
         )
-        embeds: list[discord.Embed] = []
         div_rows = split_list_to_chunks(rows, 10)
+        self_rank = flow_app.balance_ranks.rank(i.user.id)
 
-        rank = 1
-        for page_number, page in enumerate(div_rows):
-            embed = DefaultEmbed(f"暴幣排行榜 (第 {page_number + 1} 頁)")
+        async def render(index: int) -> discord.Embed:  # noqa: RUF029
+            assert i.guild is not None
+            embed = DefaultEmbed(f"暴幣排行榜 (第 {index + 1} 頁)")
             embed.description = ""
-            for row in page:
+            for rank, row in enumerate(div_rows[index], index * 10 + 1):
                 discord_user = i.guild.get_member(row["user_id"])
-                if discord_user is None:
-                    user_name = "(已離開伺服器)"
-                    await flow_app.remove_account(row["user_id"], i.client.pool)
-                else:
-                    user_name = discord_user.display_name
+                user_name = "(已離開伺服器)" if discord_user is None else discord_user.display_name
                 embed.description += f"{rank}. {user_name} | {row['flow']}\n"
-                rank += 1
-            embeds.append(embed)
-        await GeneralPaginator(i, embeds).start()
+            embed.set_footer(text=f"你的排名: {self_rank or '(未上榜)'}")
+            return embed
+
+        await GeneralPaginator(i, provider=render, page_count=lambda: len(div_rows)).start()
 
 
 async def setup(bot: commands.Bot) -> None:
@@ -1,14 +1,18 @@
 import asyncio
+import contextlib
 
 import discord
 from discord import app_commands, utils
-from discord.ext import commands
+from discord.ext import commands, tasks
 from seria.utils import split_list_to_chunks
 
+from apps import guess_num, matches
+from apps.c4 import solver
+from apps.c4.sticky import StickyManager
 from apps.c4.ui import ColorSelectView
-from apps.flow import flow_transaction, get_balance
+from apps.flow import InsufficientFlowError, flow_transaction, get_balances, settle
 from dev import model
-from dev.enum import GameType
+from dev.enum import Difficulty, GameType
 from ui.guess_num import GuessNumView
 from utility.paginator import GeneralPaginator
 from utility.utils import get_dt_now
@@ -16,177 +20,222 @@ from utility.utils import get_dt_now
 game_name = {GameType.GUESS_NUM: "猜數字", GameType.CONNECT_FOUR: "屏風式四子棋"}
 
 
-def return_a_b(answer: str, guess: str) -> tuple[int, int]:
-    """a: 猜對位置, b: 猜對數字
-
-    Args:
-        answer (str): 正確答案
-        guess (str): 猜測答案
-
-    Returns:
-        tuple[int, int]: A 和 B
-    """
-    a = 0
-    b = 0
-    for char in answer:
-        if char in guess:
-            if answer.index(char) == guess.index(char):
-                a += 1
-            else:
-                b += 1
-    return a, b
+HINT_COST = 20
+"""Flow charged for each /game hint."""
 
 
 class GameCog(commands.GroupCog, name="game"):
     def __init__(self, bot) -> None:
         self.bot: model.BotModel = bot
+        self.stickies = StickyManager()
+        self._deletions: set[asyncio.Task[None]] = set()
+        """Threads of finished matches waiting to be deleted."""
+
+    async def cog_load(self) -> None:
+        await self.bot.pool.execute(
+            """
+            ALTER TABLE guess_num
+            ADD COLUMN IF NOT EXISTS player_one_guesses TEXT[] NOT NULL DEFAULT '{}',
+            ADD COLUMN IF NOT EXISTS player_two_guesses TEXT[] NOT NULL DEFAULT '{}'
+            """
+        )
+        await asyncio.to_thread(guess_num.load_matrix)
+        await matches.load_matches(self.bot.pool)
+        self.bot.router.register(
+            "game.connect_four",
+            self.on_connect_four_message,
+            thread_only=True,
+            thread_name="四子棋",
+        )
+        self.bot.router.register(
+            "game.guess_num",
+            self.on_guess_num_message,
+            thread_only=True,
+            thread_name="猜數字",
+            pattern=r"^[0-9]{4}$",
+        )
+        self.flush_stickies.start()
+
+    async def cog_unload(self) -> None:
+        self.bot.router.unregister("game.connect_four")
+        self.bot.router.unregister("game.guess_num")
+        solver.shutdown()
+        self.flush_stickies.cancel()
+        self.stickies.cancel()
+        await self.stickies.flush(self.bot.pool)
+
+    @tasks.loop(minutes=1)
+    async def flush_stickies(self) -> None:
+        await self.stickies.flush(self.bot.pool)
+
+    async def on_connect_four_message(self, message: discord.Message, _: frozenset[str]) -> None:
+        assert isinstance(message.channel, discord.Thread)
+        match = matches.connect_four.get(message.channel.id)
+        if match is None:
+            return
+        self.stickies.bump(message.channel, match)
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):  # noqa: PLR0912
-        if message.author.bot or not isinstance(message.channel, discord.Thread):
+    async def on_guess_num_message(self, message: discord.Message, _: frozenset[str]):
+        assert isinstance(message.channel, discord.Thread)
+        if len(set(message.content)) != 4:
             return
 
-        if "四子棋" in message.channel.name:
-            row = await self.bot.pool.fetchrow(
-                "SELECT * FROM connect_four WHERE channel_id = $1", message.channel.id
-            )
-            if row is None:
-                return
-            match = model.ConnectFourMatch.from_row(row)
+        match = matches.guess_num.get(message.channel.id)
+        if match is None:
+            return
 
-            if match.sticky_id is not None:
-                sticky = await message.channel.fetch_message(match.sticky_id)
-                await sticky.delete()
+        if match.p2_guess + 1 > match.p1_guess and message.author.id != match.p1:
+            return await message.reply(embed=model.ErrorEmbed("現在是輪到玩家一猜測"))
+        if match.p1_guess + 1 > match.p2_guess + 1 and message.author.id != match.p2:
+            return await message.reply(embed=model.ErrorEmbed("現在是輪到玩家二猜測"))
+
+        answer = None
+        is_p1 = False
+        guess = "?"
+        if message.author.id == match.p1:
+            answer = match.p2_num
+            guess = match.p1_guess + 1
+            is_p1 = True
+        elif message.author.id == match.p2:
+            answer = match.p1_num
+            guess = match.p2_guess + 1
+
+        if answer:
+            a, b = await self.record_guess(match, is_p1, message.content)
+            await message.reply(embed=model.DefaultEmbed(f"{a}A{b}B", f"第{guess}次猜測"))
+
+            if a == 4:
+                await self.finish_guess_num(message.channel, match, is_p1)
+            elif match.p2 == message.channel.guild.me.id:
+                await self.shenhe_guess(message.channel, match)
+
+    async def record_guess(self, match: model.GuessNumMatch, is_p1: bool, guess: str):
+        """Count a guess towards its player and score it.
+
+        Returns:
+            tuple[int, int]: A and B of the guess.
+        """
+        # the turn is taken before awaiting, so the next message already sees it
+        if is_p1:
+            match.p1_guess += 1
+            match.p1_guesses.append(guess)
+            answer = match.p2_num
+        else:
+            match.p2_guess += 1
+            match.p2_guesses.append(guess)
+            answer = match.p1_num
+        assert answer is not None
+
+        query = "player_one" if is_p1 else "player_two"
+        await self.bot.pool.execute(
+            f"UPDATE guess_num SET {query}_guess = {query}_guess + 1, {query}_guesses = array_append({query}_guesses, $2) WHERE channel_id = $1",
+            match.channel_id,
+            guess,
+        )
+        return guess_num.get_score(answer, guess)
 
-            description = f"[點我回到遊戲]({match.board_link})"
-            sticky = await message.channel.send(embed=model.DefaultEmbed(description=description))
+    async def shenhe_guess(self, thread: discord.Thread, match: model.GuessNumMatch) -> None:
+        assert match.p1_num is not None
+        candidates = guess_num.get_candidates(match.p1_num, match.p2_guesses)
+        guess = await asyncio.to_thread(guess_num.best_guess, candidates)
+
+        a, b = await self.record_guess(match, False, guess)
+        await thread.send(
+            embed=model.DefaultEmbed(f"申鶴猜 {guess}: {a}A{b}B", f"第{match.p2_guess}次猜測")
+        )
+        if a == 4:
+            await self.finish_guess_num(thread, match, False)
+
+    async def finish_guess_num(
+        self, thread: discord.Thread, match: model.GuessNumMatch, p1_win: bool
+    ) -> None:
+        await matches.end_guess_num(thread.id, self.bot.pool)
+
+        embed = model.DefaultEmbed(
+            "恭喜答對, 遊戲結束",
+            f"玩家一: {match.p1_num}\n 玩家二: {match.p2_num}",
+        )
+        embed.set_footer(text="此討論串將在十分鐘後關閉")
+        if match.flow:
+            embed.add_field(name="賭注", value=f"{match.flow}暴幣")
+            embed.set_footer(text="暴幣已經轉入獲勝者的帳戶")
+        await thread.send(embed=embed)
+        if match.flow:
+            winner, loser = (match.p1, match.p2) if p1_win else (match.p2, match.p1)
+            await settle(loser, winner, match.flow, self.bot.pool, reason="guess_num")
+
+        await self.bot.pool.execute(
+            "INSERT INTO game_history (p1, p2, p1_win, time, flow, game) VALUES ($1, $2, $3, $4, $5, 'guess_num')",
+            match.p1,
+            match.p2,
+            p1_win,
+            get_dt_now(),
+            match.flow,
+        )
+
+        # games against Shenhe don't count towards the leaderboard
+        if match.p2 != thread.guild.me.id:
             await self.bot.pool.execute(
-                "UPDATE connect_four SET sticky_id = $1 WHERE channel_id = $2",
-                sticky.id,
-                message.channel.id,
+                "INSERT INTO game_win_lose (user_id, win, lose, game) VALUES ($1, $2, $3, 'guess_num') ON CONFLICT (user_id, game) DO UPDATE SET win = game_win_lose.win + $2, lose = game_win_lose.lose + $3",
+                match.p1,
+                1 if p1_win else 0,
+                1 if not p1_win else 0,
             )
-        elif (
-            "猜數字" in message.channel.name
-            and message.content.isdigit()
-            and len(message.content) == 4
-            and len(set(message.content)) == 4
-        ):
-            row = await self.bot.pool.fetchrow(
-                "SELECT * FROM guess_num WHERE channel_id = $1 AND player_one_num IS NOT NULL AND player_two_num IS NOT NULL",
-                message.channel.id,
+            await self.bot.pool.execute(
+                "INSERT INTO game_win_lose (user_id, win, lose, game) VALUES ($1, $2, $3, 'guess_num') ON CONFLICT (user_id, game) DO UPDATE SET win = game_win_lose.win + $2, lose = game_win_lose.lose + $3",
+                match.p2,
+                1 if not p1_win else 0,
+                1 if p1_win else 0,
             )
-            if row is None:
-                return
-            match = model.GuessNumMatch.from_row(row)
-
-            if match.p2_guess + 1 > match.p1_guess and message.author.id != match.p1:
-                return await message.reply(embed=model.ErrorEmbed("現在是輪到玩家一猜測"))
-            if match.p1_guess + 1 > match.p2_guess + 1 and message.author.id != match.p2:
-                return await message.reply(embed=model.ErrorEmbed("現在是輪到玩家二猜測"))
-
-            answer = None
-            is_p1 = False
-            guess = "?"
-            if message.author.id == match.p1:
-                answer = match.p2_num
-                guess = match.p1_guess + 1
-                is_p1 = True
-            elif message.author.id == match.p2:
-                answer = match.p1_num
-                guess = match.p2_guess + 1
-
-            if answer:
-                query = "player_one" if is_p1 else "player_two"
-                await self.bot.pool.execute(
-                    f"UPDATE guess_num SET {query}_guess = {query}_guess + 1 WHERE channel_id = $1",
-                    message.channel.id,
-                )
-                a, b = return_a_b(answer, message.content)
-                await message.reply(embed=model.DefaultEmbed(f"{a}A{b}B", f"第{guess}次猜測"))
-
-                if a == 4:
-                    embed = model.DefaultEmbed(
-                        "恭喜答對, 遊戲結束",
-                        f"玩家一: {match.p1_num}\n 玩家二: {match.p2_num}",
-                    )
-                    embed.set_footer(text="此討論串將在十分鐘後關閉")
-                    if match.flow:
-                        embed.add_field(name="賭注", value=f"{match.flow}暴幣")
-                        embed.set_footer(text="暴幣已經轉入獲勝者的帳戶")
-                    await message.reply(embed=embed)
-                    if match.flow:
-                        await flow_transaction(
-                            match.p1,
-                            match.flow if is_p1 else -match.flow,
-                            self.bot.pool,
-                        )
-                        await flow_transaction(
-                            match.p2,
-                            match.flow if not is_p1 else -match.flow,
-                            self.bot.pool,
-                        )
-
-                    await self.bot.pool.execute(
-                        "DELETE FROM guess_num WHERE channel_id = $1",
-                        message.channel.id,
-                    )
-                    await self.bot.pool.execute(
-                        "INSERT INTO game_history (p1, p2, p1_win, time, flow, game) VALUES ($1, $2, $3, $4, $5, 'guess_num')",
-                        match.p1,
-                        match.p2,
-                        is_p1,
-                        get_dt_now(),
-                        match.flow,
-                    )
-
-                    await self.bot.pool.execute(
-                        "INSERT INTO game_win_lose (user_id, win, lose, game) VALUES ($1, $2, $3, 'guess_num') ON CONFLICT (user_id, game) DO UPDATE SET win = game_win_lose.win + $2, lose = game_win_lose.lose + $3",
-                        match.p1,
-                        1 if is_p1 else 0,
-                        1 if not is_p1 else 0,
-                    )
-                    await self.bot.pool.execute(
-                        "INSERT INTO game_win_lose (user_id, win, lose, game) VALUES ($1, $2, $3, 'guess_num') ON CONFLICT (user_id, game) DO UPDATE SET win = game_win_lose.win + $2, lose = game_win_lose.lose + $3",
-                        match.p2,
-                        1 if not is_p1 else 0,
-                        1 if is_p1 else 0,
-                    )
-
-                    await asyncio.sleep(600.0)
-                    await message.channel.delete()
+
+        # in the background, this runs inside a message route whose timing it would swallow
+        task = asyncio.create_task(self._delete_thread(thread, 600.0))
+        self._deletions.add(task)
+        task.add_done_callback(self._deletions.discard)
+
+    @staticmethod
+    async def _delete_thread(thread: discord.Thread, delay: float) -> None:
+        await asyncio.sleep(delay)
+        with contextlib.suppress(discord.NotFound):
+            await thread.delete()
 
     @app_commands.guild_only()
     @app_commands.command(name="start", description="開始一個小遊戲")
-    @app_commands.rename(game="遊戲", opponent="對手", flow="賭注")
+    @app_commands.rename(game="遊戲", opponent="對手", flow="賭注", difficulty="難度")
     @app_commands.choices(
         game=[
             app_commands.Choice(name="猜數字", value="guess_num"),
             app_commands.Choice(name="屏風式四子棋", value="connect_four"),
-        ]
+        ],
+        difficulty=[
+            app_commands.Choice(name="簡單", value="easy"),
+            app_commands.Choice(name="普通", value="normal"),
+            app_commands.Choice(name="困難", value="hard"),
+        ],
     )
     @app_commands.describe(
         game="要遊玩的小遊戲",
-        opponent="小遊戲的對手(玩家二)",
+        opponent="小遊戲的對手(玩家二), 也可以選擇申鶴",
         flow="要下賭的暴幣數量",
+        difficulty="和申鶴下四子棋時的難度, 預設為普通",
     )
     async def start(
         self,
         inter: discord.Interaction,
         opponent: discord.Member,
         game: GameType,
-        flow: int | None = None,
+        flow: app_commands.Range[int, 1] | None = None,
+        difficulty: Difficulty = Difficulty.NORMAL,
     ):
         i: model.Inter = inter  # type: ignore
-        assert isinstance(i.user, discord.Member)
+        assert isinstance(i.user, discord.Member) and i.guild
 
-        user_flow = await get_balance(i.user.id, self.bot.pool)
-        if flow and flow > user_flow:
+        vs_shenhe = opponent == i.guild.me
+        if vs_shenhe and flow:
             return await i.response.send_message(
-                embed=model.ErrorEmbed("你擁有的暴幣不足以承擔這個賭注", f"所需暴幣: {flow}"),
-                ephemeral=True,
+                embed=model.ErrorEmbed("錯誤", "和申鶴對戰時不能下賭注"), ephemeral=True
             )
-
-        if opponent.bot:
+        if opponent.bot and not vs_shenhe:
             return await i.response.send_message(
                 embed=model.ErrorEmbed("錯誤", "對手不能是機器人 (雖然那樣會蠻酷的)"),
                 ephemeral=True,
@@ -196,6 +245,19 @@ class GameCog(commands.GroupCog, name="game"):
                 embed=model.ErrorEmbed("錯誤", "對手不能是自己"), ephemeral=True
             )
 
+        if flow:
+            balances = await get_balances((i.user.id, opponent.id), self.bot.pool)
+            if flow > balances[i.user.id]:
+                return await i.response.send_message(
+                    embed=model.ErrorEmbed("你擁有的暴幣不足以承擔這個賭注", f"所需暴幣: {flow}"),
+                    ephemeral=True,
+                )
+            if flow > balances[opponent.id]:
+                return await i.response.send_message(
+                    embed=model.ErrorEmbed("對手擁有的暴幣不足以承擔這個賭注", f"所需暴幣: {flow}"),
+                    ephemeral=True,
+                )
+
         if game is GameType.GUESS_NUM:
             embed = model.DefaultEmbed(
                 "請雙方設定數字",
@@ -229,7 +291,7 @@ class GameCog(commands.GroupCog, name="game"):
             if flow:
                 embed.add_field(name="賭注", value=f"{flow} 暴幣", inline=False)
 
-            view = ColorSelectView(i.user, opponent, embed, flow)
+            view = ColorSelectView(i.user, opponent, embed, flow, difficulty if vs_shenhe else None)
             await i.response.send_message(
                 content=f"{i.user.mention} {opponent.mention}",
                 embed=embed,
@@ -237,6 +299,43 @@ class GameCog(commands.GroupCog, name="game"):
             )
             view.message = await i.original_response()
 
+    @app_commands.guild_only()
+    @app_commands.command(name="hint", description="花費暴幣取得猜數字的提示")
+    async def hint(self, inter: discord.Interaction) -> None:
+        i: model.Inter = inter  # type: ignore
+        match = None if i.channel_id is None else matches.guess_num.get(i.channel_id)
+        if match is None or i.user.id not in {match.p1, match.p2}:
+            return await i.response.send_message(
+                embed=model.ErrorEmbed("錯誤", "請在自己正在進行的猜數字討論串中使用這個指令"),
+                ephemeral=True,
+            )
+
+        if i.user.id == match.p1:
+            answer, guesses = match.p2_num, match.p1_guesses
+        else:
+            answer, guesses = match.p1_num, match.p2_guesses
+        assert answer is not None
+        candidates = guess_num.get_candidates(answer, guesses)
+        suggestion = await asyncio.to_thread(guess_num.best_guess, candidates)
+
+        # charged only once the hint is ready
+        try:
+            await flow_transaction(i.user.id, -HINT_COST, self.bot.pool, reason="guess_num_hint")
+        except InsufficientFlowError as e:
+            return await i.response.send_message(
+                embed=model.ErrorEmbed(
+                    "你的暴幣不足", f"提示需要 {HINT_COST} 暴幣, 你只有 {e.balance} 暴幣"
+                ),
+                ephemeral=True,
+            )
+
+        embed = model.DefaultEmbed(
+            "提示",
+            f"根據你的猜測, 答案還有 **{len(candidates)}** 種可能\n建議下一次猜 **{suggestion}**",
+        )
+        embed.set_footer(text=f"已花費 {HINT_COST} 暴幣")
+        await i.response.send_message(embed=embed, ephemeral=True)
+
     @app_commands.guild_only()
     @app_commands.command(name="rules", description="查看遊戲規則")
     @app_commands.rename(game="遊戲")
@@ -252,7 +351,7 @@ class GameCog(commands.GroupCog, name="game"):
 
         if game is GameType.GUESS_NUM:
             embed = model.DefaultEmbed(
-                description="""
+                description=f"""
                 開始: `/gn start <對手>`
                 雙方各設定一個四位數字,數字之間不可重複,可包含0。
                 例如 1234、5678、9012、3456、7890等等。
@@ -262,6 +361,8 @@ class GameCog(commands.GroupCog, name="game"):
                 如果猜對一個數字且位置相同,則得 **1A**
                 如果猜對一個數字,但是位置不同,則得 **1B**
                 例如,如果答案是1234,而你猜4321,則得到0A4B。
+
+                提示: `/game hint` (每次 {HINT_COST} 暴幣)
                 """
             )
         elif game is GameType.CONNECT_FOUR:
@@ -296,33 +397,30 @@ class GameCog(commands.GroupCog, name="game"):
 
         # sort by win_rate attribute, desc
         all_players = sorted(all_players, key=lambda x: x.win_rate, reverse=True)
+        if not all_players:
+            return await i.followup.send(
+                embed=model.ErrorEmbed("錯誤", "目前該遊戲沒有排行榜資料"),
+                ephemeral=True,
+            )
+
         div_players = split_list_to_chunks(all_players, 10)
+        player_rank = next(
+            (rank for rank, p in enumerate(all_players, 1) if p.user_id == i.user.id), None
+        )
 
-        embeds: list[discord.Embed] = []
-        rank = 0
-        player_rank = None
-        for players in div_players:
-            embed = model.DefaultEmbed()
+        async def render(index: int) -> discord.Embed:  # noqa: RUF029
+            embed = model.DefaultEmbed(f"你的排名:{player_rank}")
             embed.description = ""
 
             embed.set_author(name=f"🏆 {game_name.get(game, '未知遊戲')}排行榜")
-            for player in players:
-                rank += 1
-                if player.user_id == i.user.id:
-                    player_rank = rank
-
+            for rank, player in enumerate(div_players[index], index * 10 + 1):
                 embed.description += f"{rank}. <@{player.user_id}> {player.win}勝{player.lose}敗 ({player.win / (player.win + player.lose) * 100:.2f}%)\n"
-            embed.title = f"你的排名:{player_rank}"
             embed.set_footer(text="只有進行十場遊戲以上的玩家才會進入排行榜")
-            embeds.append(embed)
+            return embed
 
-        if not embeds:
-            return await i.followup.send(
-                embed=model.ErrorEmbed("錯誤", "目前該遊戲沒有排行榜資料"),
-                ephemeral=True,
-            )
-
-        await GeneralPaginator(i, embeds).start(followup=True)
+        await GeneralPaginator(i, provider=render, page_count=lambda: len(div_players)).start(
+            followup=True
+        )
 
     @app_commands.guild_only()
     @app_commands.command(name="history", description="查看猜數字對戰紀錄")
@@ -351,15 +449,20 @@ class GameCog(commands.GroupCog, name="game"):
             game.value,
         )
         histories: list[model.GameHistory] = [model.GameHistory.from_row(row) for row in rows]
+        if not histories:
+            return await i.followup.send(
+                embed=model.ErrorEmbed("錯誤", "你目前在該遊戲沒有對戰紀錄"),
+                ephemeral=True,
+            )
         div_histories = split_list_to_chunks(histories, 10)
 
-        embeds: list[discord.Embed] = []
-        for histories in div_histories:
+        async def render(index: int) -> discord.Embed:
+            assert i.guild
             embed = model.DefaultEmbed()
             embed.set_author(
                 name=f"📜 {member.display_name} 的 {game_name.get(game, '未知遊戲')}對戰紀錄"
             )
-            for history in histories:
+            for history in div_histories[index]:
                 p1 = i.guild.get_member(history.p1) or await i.guild.fetch_member(history.p1)
                 p2 = i.guild.get_member(history.p2) or await i.guild.fetch_member(history.p2)
                 if history.p1_win is None:
@@ -374,15 +477,11 @@ class GameCog(commands.GroupCog, name="game"):
                     value=f"{utils.format_dt(history.match_time)}\n{flow}",
                     inline=False,
                 )
-            embeds.append(embed)
-
-        if not embeds:
-            return await i.followup.send(
-                embed=model.ErrorEmbed("錯誤", "你目前在該遊戲沒有對戰紀錄"),
-                ephemeral=True,
-            )
+            return embed
 
-        await GeneralPaginator(i, embeds).start(followup=True)
+        await GeneralPaginator(i, provider=render, page_count=lambda: len(div_histories)).start(
+            followup=True
+        )
 
 
 async def setup(bot: commands.Bot) -> None:
@@ -7,7 +7,7 @@ from discord import app_commands, ui
 from discord.ext import commands
 from seria.utils import split_list_to_chunks
 
-from apps.flow import flow_transaction, get_balance
+from apps.flow import InsufficientFlowError, transfer
 from dev.model import BotModel, DefaultEmbed, ErrorEmbed, Inter
 from utility.paginator import GeneralPaginator
 
@@ -120,21 +120,19 @@ class GiveAwayView(ui.View):
     async def join_gv(self, inter: discord.Interaction, button: ui.Button):
         i: Inter = inter  # type: ignore
 
-        if self.gv.bao > 0 and i.user.id not in self.gv.participants:
-            bao = await get_balance(i.user.id, i.client.pool)
-            if bao < self.gv.bao:
+        if i.user.id in self.gv.participants:
+            self.gv.participants.remove(i.user.id)
+            await transfer(None, i.user.id, self.gv.bao, i.client.pool, reason="giveaway")
+        else:
+            try:
+                await transfer(i.user.id, None, self.gv.bao, i.client.pool, reason="giveaway")
+            except InsufficientFlowError as e:
                 embed = ErrorEmbed(
                     "暴幣不足",
-                    f"你的暴幣不足以參加此抽獎\n需要 **{self.gv.bao}** 暴幣,你現在有 **{bao}** 暴幣",
+                    f"你的暴幣不足以參加此抽獎\n需要 **{self.gv.bao}** 暴幣,你現在有 **{e.balance}** 暴幣",
                 )
                 return await i.response.send_message(embed=embed, ephemeral=True)
-
-        if i.user.id in self.gv.participants:
-            self.gv.participants.remove(i.user.id)
-            await flow_transaction(i.user.id, self.gv.bao, i.client.pool)
-        else:
             self.gv.participants.append(i.user.id)
-            await flow_transaction(i.user.id, -self.gv.bao, i.client.pool)
 
         button.label = str(len(self.gv.participants))
         await self.gv.update_participants(i.client.pool)
@@ -152,19 +150,20 @@ class GiveAwayView(ui.View):
             await i.response.send_message(embed=embed, ephemeral=True)
         else:
             # 10 participants per embed
-            embeds: list[discord.Embed] = []
             participants = split_list_to_chunks(self.gv.participants.copy(), 10)
-            index = 1
-            for div in participants:
+            total = len(self.gv.participants)
+
+            async def render(index: int) -> discord.Embed:  # noqa: RUF029
                 embed = DefaultEmbed("參加者")
                 embed.description = ""
-                for p in div:
-                    embed.description += f"{index}. <@{p}>\n"
-                    index += 1
-                embed.description += f"\n共 **{len(self.gv.participants)}** 位參加者"
-                embeds.append(embed)
+                for number, p in enumerate(participants[index], index * 10 + 1):
+                    embed.description += f"{number}. <@{p}>\n"
+                embed.description += f"\n共 **{total}** 位參加者"
+                return embed
 
-            await GeneralPaginator(i, embeds).start(ephemeral=True)
+            await GeneralPaginator(i, provider=render, page_count=lambda: len(participants)).start(
+                ephemeral=True
+            )
 
     @ui.button(label="結束抽獎", style=discord.ButtonStyle.red, custom_id="end_gv")
     async def end_gv(self, i: discord.Interaction, button: ui.Button) -> None:
@@ -1,22 +1,39 @@
 import asyncio
+import math
+from collections import defaultdict
 from typing import TYPE_CHECKING, Any, Optional
 
 import discord
 from discord import app_commands
 from discord.ext import commands, tasks
-from seria.utils import split_list_to_chunks
-
+from loguru import logger
+
+from apps.level.cache import COOLDOWN, DAILY_CAP, XPCache
+from apps.level.curve import get_level, get_levels, get_xp_required
+from apps.level.leaderboard import (
+    PAGE_SIZE,
+    XPColumn,
+    get_leaderboard_page,
+    get_ranked_count,
+    load_rank_indexes,
+)
+from apps.level.schema import setup_level_schema
+from apps.level.voice import VoiceSessions
 from dev.model import BaseView, BotModel, DefaultEmbed, ErrorEmbed, Inter
 from utility.paginator import GeneralPaginator
+from utility.rank import RankIndex
 from utility.utils import get_dt_now
 
 if TYPE_CHECKING:
     import datetime
 
+    import asyncpg
+
 
 class LevelSetting(BaseView):
-    def __init__(self) -> None:
+    def __init__(self, xp_cache: XPCache) -> None:
         super().__init__(timeout=600.0)
+        self.xp_cache = xp_cache
 
     async def start(self, i: Inter) -> Any:
         assert i.guild is not None
@@ -54,6 +71,7 @@ class EnableNotif(discord.ui.Button):
             i.user.id,
             i.guild.id,
         )
+        self.view.xp_cache.set_notif(i.guild.id, i.user.id, True)
         await self.view.start(i)
 
 
@@ -74,29 +92,162 @@ class DisableNotif(discord.ui.Button):
             i.user.id,
             i.guild.id,
         )
+        self.view.xp_cache.set_notif(i.guild.id, i.user.id, False)
         await self.view.start(i)
 
 
+class LeaderboardPages:
+    def __init__(
+        self,
+        guild: discord.Guild,
+        column: XPColumn,
+        total: int,
+        self_rank: int | None,
+        pool: "asyncpg.Pool",
+    ) -> None:
+        self.guild = guild
+        self.column = column
+        self.total = total
+        self.self_rank = self_rank
+        self.pool = pool
+
+        # page index -> keyset of the first and last row on that page
+        self.bounds: dict[int, tuple[tuple[int, int], tuple[int, int]]] = {}
+
+    def page_count(self) -> int:
+        return math.ceil(self.total / PAGE_SIZE)
+
+    async def fetch_rows(self, index: int) -> list["asyncpg.Record"]:
+        """Fetch a page, continuing from the keyset of a neighbouring page when possible"""
+        guild_id = self.guild.id
+        if index - 1 in self.bounds:
+            cursor = self.bounds[index - 1][1]
+            return await get_leaderboard_page(guild_id, self.column, self.pool, cursor=cursor)
+        if index + 1 in self.bounds:
+            cursor = self.bounds[index + 1][0]
+            return await get_leaderboard_page(
+                guild_id, self.column, self.pool, cursor=cursor, reverse=True
+            )
+        if index > 0 and index == self.page_count() - 1:
+            return await get_leaderboard_page(
+                guild_id,
+                self.column,
+                self.pool,
+                reverse=True,
+                limit=self.total - index * PAGE_SIZE,
+            )
+        return await get_leaderboard_page(guild_id, self.column, self.pool)
+
+    async def __call__(self, index: int) -> discord.Embed:
+        rows = await self.fetch_rows(index)
+        if rows:
+            self.bounds[index] = (
+                (rows[0]["xp"], rows[0]["user_id"]),
+                (rows[-1]["xp"], rows[-1]["user_id"]),
+            )
+
+        word = "聊天" if self.column == "chat_xp" else "語音"
+        embed = DefaultEmbed(f"{word}等級排行榜")
+        embed.set_author(
+            name=self.guild.name, icon_url=self.guild.icon.url if self.guild.icon else None
+        )
+        embed.description = ""
+        levels = get_levels([row["xp"] for row in rows])
+        for row, level in zip(rows, levels, strict=True):
+            member = self.guild.get_member(row["user_id"])
+            name = member.display_name if member else "(已離開伺服器)"
+            embed.description += f"{row['rank']}. {name} | {level}等 ({row['xp']})\n"
+        embed.set_footer(text=f"你的排名: {self.self_rank or '(未上榜)'}")
+
+        return embed
+
+
 class LevelCog(commands.GroupCog, name="level"):  # noqa: PLR0904
     def __init__(self, bot) -> None:
         self.bot: BotModel = bot
+        self.xp_cache = XPCache(bot.pool)
+        self.voice_sessions = VoiceSessions(bot.pool)
+        self.ranks: defaultdict[tuple[int, XPColumn], RankIndex] = defaultdict(RankIndex)
+        self._voice_restored: asyncio.Task[None] | None = None
 
     async def cog_load(self) -> None:
-        self.clear_today_earn.start()
+        await setup_level_schema(self.bot.pool)
+        self.ranks.update(await load_rank_indexes(self.bot.pool))
+        self.bot.router.register("level.chat_xp", self.on_chat_message, guild_only=True)
+        self._voice_restored = asyncio.create_task(self.restore_voice_sessions())
+        self.flush_xp.start()
+        self.checkpoint_voice.start()
+        self.credit_voice_xp.start()
 
     async def cog_unload(self) -> None:
-        self.clear_today_earn.cancel()
-
-    # clear today_earn every day
-    @tasks.loop(hours=1)
-    async def clear_today_earn(self) -> None:
-        if get_dt_now().hour == 0:
-            await self.bot.pool.execute(
-                """
-                UPDATE levels
-                SET today_earn = 0
-                """
-            )
+        self.bot.router.unregister("level.chat_xp")
+        self.flush_xp.cancel()
+        self.checkpoint_voice.cancel()
+        self.credit_voice_xp.cancel()
+        if self._voice_restored is not None:
+            self._voice_restored.cancel()
+        await self.xp_cache.flush()
+        await self.voice_sessions.credit(get_dt_now())
+        await self.voice_sessions.checkpoint()
+
+    # the caches keep what failed to be written, so errors are only logged and the loops go on
+    # to retry it on the next tick, an exception would stop tasks.loop for good
+
+    @tasks.loop(seconds=5)
+    async def flush_xp(self) -> None:
+        try:
+            await self.xp_cache.flush()
+        except Exception:
+            logger.exception("Failed to flush chat XP")
+
+    @tasks.loop(minutes=3)
+    async def checkpoint_voice(self) -> None:
+        try:
+            await self.voice_sessions.checkpoint()
+        except Exception:
+            logger.exception("Failed to checkpoint voice sessions")
+
+    async def restore_voice_sessions(self) -> None:
+        await self.bot.wait_until_ready()
+        for guild in self.bot.guilds:
+            await self.voice_sessions.restore(guild)
+
+    # both voice loops wait for the one restore, a credit or checkpoint before it would see
+    # only the sessions opened since the bot connected
+
+    @checkpoint_voice.before_loop
+    async def before_checkpoint_voice(self) -> None:
+        assert self._voice_restored is not None
+        await self._voice_restored
+
+    @tasks.loop(minutes=1)
+    async def credit_voice_xp(self) -> None:
+        try:
+            credited = await self.voice_sessions.credit(get_dt_now())
+        except Exception:
+            logger.exception("Failed to credit voice XP")
+            return
+
+        for guild_id, user_id, _, after, _ in credited:
+            self.ranks[guild_id, "voice_xp"].set(user_id, after)
+
+        chat = self.bot.get_channel(1061881312790720602)
+        if not isinstance(chat, discord.TextChannel):
+            return
+        for guild_id, user_id, before, after, notif in credited:
+            current, future = get_level(before), get_level(after)
+            if not notif or current >= future:
+                continue
+            guild = self.bot.get_guild(guild_id)
+            member = guild.get_member(user_id) if guild else None
+            if member is not None:
+                embed = self.get_level_up_embed(member, future, is_voice=True)
+                await chat.send(content=member.mention, embed=embed)
+
+    @credit_voice_xp.before_loop
+    async def before_credit_voice_xp(self) -> None:
+        assert self._voice_restored is not None
+        await self._voice_restored
 
     # voice xp level system
     @commands.Cog.listener()
@@ -109,52 +260,46 @@ class LevelCog(commands.GroupCog, name="level"):  # noqa: PLR0904
         if member.bot or not member.guild or before.channel == after.channel:
             return
 
-        await self.create_level_user(member)
-        await self.create_voice_user(member)
-
-        # if the user joins a voice channel
-        if before.channel is None and after.channel is not None:
-            await self.set_joined_at(member, after.channel)
-
-        # if the user leaves a voice channel
-        elif before.channel is not None and after.channel is None:
-            joined_at = await self.get_joined_at(member)
-            if joined_at is None:
-                return
-            await self.give_voice_xp(member, joined_at)
-
-        # if the user switches voice channels
-        elif before.channel is not None and after.channel is not None:
-            joined_at = await self.get_joined_at(member)
-            if joined_at is None:
-                return
-            await self.give_voice_xp(member, joined_at)
-            await self.set_joined_at(member, after.channel)
+        if after.channel is not None:
+            self.voice_sessions.open(member, after.channel, get_dt_now())
+        else:
+            self.voice_sessions.close(member, get_dt_now())
 
     # text xp level system
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message) -> None:
-        if (
-            message.author.bot
-            or not message.guild
-            or not isinstance(message.author, discord.Member)
-        ):
-            return
-        await self.create_level_user(message.author)
-
-        last_get = await self.get_last_get(message.author)
-        if (get_dt_now() - last_get).total_seconds() < 30:
-            return
-
-        today_earn = await self.get_today_earn(message.author)
-        if today_earn >= 400:
+    async def on_chat_message(self, message: discord.Message, _: frozenset[str]) -> None:
+        if not isinstance(message.author, discord.Member):
             return
+        member = message.author
+
+        state = self.xp_cache.get(member.guild.id, member.id)
+        if state is None:
+            row = await self.update_xp(member, 1)
+            if row is None:
+                # nothing was granted, still cache the row so the next messages skip the upsert
+                row = await self.bot.pool.fetchrow(
+                    """
+                    SELECT chat_xp, today_earn, earn_date, last_get, notif FROM levels
+                    WHERE user_id = $1 AND guild_id = $2
+                    """,
+                    member.id,
+                    member.guild.id,
+                )
+                if row is not None:
+                    self.xp_cache.seed(member.guild.id, member.id, row)
+                return
+            state = self.xp_cache.seed(member.guild.id, member.id, row)
+            before, after = state.chat_xp - 1, state.chat_xp
+        else:
+            result = self.xp_cache.add_xp(state, 1, get_dt_now())
+            if result is None:
+                return
+            before, after = result
+        self.ranks[member.guild.id, "chat_xp"].set(member.id, after)
 
-        current, future = await self.update_xp(message.author, 1)
-        notif = await self.get_notif(message.author)
-        if notif and current < future:
-            embed = self.get_level_up_embed(message.author, future)
-            await message.channel.send(content=message.author.mention, embed=embed)
+        current, future = get_level(before), get_level(after)
+        if state.notif and current < future:
+            embed = self.get_level_up_embed(member, future)
+            await message.channel.send(content=member.mention, embed=embed)
 
     @app_commands.guild_only()
     @app_commands.command(name="check", description="查看等級")
@@ -176,11 +321,11 @@ class LevelCog(commands.GroupCog, name="level"):  # noqa: PLR0904
             return await i.followup.send(embed=embed)
 
         chat_xp: int = stats["chat_xp"]
-        chat_level = self.get_level(chat_xp)
-        chat_req = self.get_xp_required(chat_level + 1)
+        chat_level = get_level(chat_xp)
+        chat_req = get_xp_required(chat_level + 1)
         voice_xp: int = stats["voice_xp"]
-        voice_level = self.get_level(voice_xp)
-        voice_req = self.get_xp_required(voice_level + 1)
+        voice_level = get_level(voice_xp)
+        voice_req = get_xp_required(voice_level + 1)
         start_date: datetime.datetime = stats["start_date"]
 
         time_passed = (get_dt_now() - start_date).total_seconds()
@@ -197,6 +342,13 @@ class LevelCog(commands.GroupCog, name="level"):  # noqa: PLR0904
             name="語音等級",
             value=f"Lv.{voice_level} ({voice_xp}/{voice_req})",
         )
+        chat_rank = self.get_rank(member, "chat_xp", chat_xp)
+        voice_rank = self.get_rank(member, "voice_xp", voice_xp)
+        embed.add_field(
+            name="排名",
+            value=f"聊天: 第 {chat_rank} 名 | 語音: 第 {voice_rank} 名",
+            inline=False,
+        )
         embed.add_field(
             name="平均每日經驗",
             value=f"聊天: {round(avg_chat_xp_per_day, 2)} | 語音: {round(avg_voice_xp_per_day, 2)}",
@@ -229,52 +381,16 @@ class LevelCog(commands.GroupCog, name="level"):  # noqa: PLR0904
     async def leaderboard(self, i: discord.Interaction, order_by_chat: int):
         await i.response.defer()
 
-        order_by_chat = bool(order_by_chat)
         assert i.guild is not None
-        stats = await self.bot.pool.fetch(
-            "SELECT user_id, chat_xp, voice_xp FROM levels WHERE guild_id = $1",
-            i.guild.id,
-        )
-
-        if not stats:
+        column: XPColumn = "chat_xp" if order_by_chat else "voice_xp"
+        total = await get_ranked_count(i.guild.id, self.bot.pool)
+        if not total:
             embed = ErrorEmbed("目前排行榜沒有資料")
             return await i.followup.send(embed=embed)
 
-        query = "chat_xp" if order_by_chat else "voice_xp"
-        stats.sort(key=lambda x: x[query], reverse=True)
-
-        embeds: list[discord.Embed] = []
-        div_stats = split_list_to_chunks(stats, 10)
-        word = "聊天" if order_by_chat else "語音"
-        rank = 1
-        self_rank = None
-        assert i.guild.icon
-
-        for div in div_stats:
-            embed = DefaultEmbed(f"{word}等級排行榜")
-            embed.set_author(name=i.guild.name, icon_url=i.guild.icon.url)
-            embed.description = ""
-            for stat in div:
-                if stat["user_id"] == i.user.id:
-                    self_rank = rank
-                member = i.guild.get_member(stat["user_id"])
-                if member is None:
-                    await self.bot.pool.execute(
-                        "DELETE FROM levels WHERE user_id = $1", stat["user_id"]
-                    )
-                    continue
-
-                xp = stat[query]
-                embed.description += (
-                    f"{rank}. {member.display_name} | {self.get_level(xp)}等 ({xp})\n"
-                )
-                rank += 1
-            embeds.append(embed)
-
-        for embed in embeds:
-            embed.set_footer(text=f"你的排名: {self_rank if self_rank else '(未上榜)'}")
-
-        await GeneralPaginator(i, embeds).start(followup=True)
+        self_rank = self.ranks[i.guild.id, column].rank(i.user.id)
+        pages = LeaderboardPages(i.guild, column, total, self_rank, self.bot.pool)
+        await GeneralPaginator(i, provider=pages, page_count=pages.page_count).start(followup=True)
 
     @app_commands.command(name="rules", description="查看等級系統規則")
     async def rules(self, i: discord.Interaction) -> None:
@@ -294,7 +410,7 @@ class LevelCog(commands.GroupCog, name="level"):  # noqa: PLR0904
     @app_commands.command(name="settings", description="查看等級系統設定")
     async def settings(self, inter: discord.Interaction) -> None:
         i: Inter = inter  # type: ignore
-        view = LevelSetting()
+        view = LevelSetting(self.xp_cache)
         await view.start(i)
 
     @commands.is_owner()
@@ -317,68 +433,21 @@ class LevelCog(commands.GroupCog, name="level"):  # noqa: PLR0904
             member.guild.id,
         )
 
-    async def create_voice_user(self, member: discord.Member) -> None:
-        await self.bot.pool.execute(
-            """
-            INSERT INTO voice_xp (user_id, guild_id)
-            VALUES ($1, $2)
-            ON CONFLICT DO NOTHING
-            """,
-            member.id,
-            member.guild.id,
-        )
-
-    async def get_joined_at(self, member) -> Optional["datetime.datetime"]:
-        joined_at = await self.bot.pool.fetchval(
-            """
-            SELECT joined_at
-            FROM voice_xp
-            WHERE user_id = $1
-            AND guild_id = $2
-            """,
-            member.id,
-            member.guild.id,
-        )
-
-        return joined_at
-
-    async def set_joined_at(
-        self,
-        member: discord.Member,
-        channel: discord.VoiceChannel | discord.StageChannel,
-    ) -> None:
-        await self.bot.pool.execute(
-            """
-            UPDATE voice_xp
-            SET joined_at = $1, channel_id = $2
-            WHERE user_id = $3
-            AND guild_id = $4
-            """,
-            get_dt_now(),
-            channel.id,
-            member.id,
-            member.guild.id,
-        )
-
-    async def give_voice_xp(self, member: discord.Member, joined_at: "datetime.datetime") -> None:
-        # calculate xp
-        second = int((get_dt_now() - joined_at).total_seconds())
-        xp = second // 300
-
-        # add xp to user
-        current, future = await self.update_xp(member, xp, is_voice=True)
-        notif = await self.get_notif(member)
-        if notif and current < future:
-            chat = self.bot.get_channel(1061881312790720602)
-            if isinstance(chat, discord.TextChannel):
-                embed = self.get_level_up_embed(member, future, is_voice=True)
-                await chat.send(content=member.mention, embed=embed)
+    def get_rank(self, member: discord.Member, column: XPColumn, xp: int) -> int:
+        ranks = self.ranks[member.guild.id, column]
+        if member.id not in ranks:
+            # the row was inserted without going through the index, add it from what was read,
+            # an indexed score can be newer than the row so it's left alone
+            ranks.set(member.id, xp)
+        rank = ranks.rank(member.id)
+        assert rank is not None
+        return rank
 
     def get_level_up_embed(self, member: discord.Member, future: int, *, is_voice=False):
         word = "語音" if is_voice else "聊天"
         embed = DefaultEmbed(
             f"恭喜 {member.display_name} 的{word}等級升級到了 {future} 等",
-            f"升級到 {future + 1} 等需要 {self.get_xp_required(future + 1)} 點{word}經驗",
+            f"升級到 {future + 1} 等需要 {get_xp_required(future + 1)} 點{word}經驗",
         )
         embed.set_author(name="🎉 升級啦!!", icon_url=member.display_avatar.url)
         embed.set_thumbnail(
@@ -387,96 +456,35 @@ class LevelCog(commands.GroupCog, name="level"):  # noqa: PLR0904
 
         return embed
 
-    async def get_today_earn(self, member: discord.Member) -> int:
-        today_earn = await self.bot.pool.fetchval(
-            """
-            SELECT today_earn
-            FROM levels
-            WHERE user_id = $1
-            AND guild_id = $2
-            """,
-            member.id,
-            member.guild.id,
-        )
-
-        return today_earn
-
-    async def get_last_get(self, member: discord.Member) -> "datetime.datetime":
-        last_get = await self.bot.pool.fetchval(
-            """
-            SELECT last_get
-            FROM levels
-            WHERE user_id = $1
-            AND guild_id = $2
-            """,
-            member.id,
-            member.guild.id,
-        )
+    async def update_xp(self, member: discord.Member, xp: int) -> Optional["asyncpg.Record"]:
+        """Create the member's row if needed and grant chat XP in a single statement.
 
-        return last_get
+        XP is only granted when the cooldown has passed and the daily cap is not reached,
+        a today_earn from an earlier day is rolled over to zero first.
 
-    async def create_level_user(self, member: discord.Member) -> None:
-        await self.bot.pool.execute(
+        Returns:
+            asyncpg.Record | None: The updated row, None if no XP was granted.
+        """
+        return await self.bot.pool.fetchrow(
             """
-            INSERT INTO levels (user_id, guild_id, start_date, last_get)
-            VALUES ($1, $2, $3, $3)
-            ON CONFLICT DO NOTHING
+            INSERT INTO levels AS l
+            (user_id, guild_id, start_date, last_get, chat_xp, today_earn, earn_date)
+            VALUES ($1, $2, $3, $3, $4, $4, $3::date)
+            ON CONFLICT (user_id, guild_id) DO UPDATE
+            SET chat_xp = l.chat_xp + $4,
+                today_earn = CASE WHEN l.earn_date = $3::date THEN l.today_earn ELSE 0 END + $4,
+                earn_date = $3::date,
+                last_get = $3
+            WHERE l.last_get < $3 - $5 * INTERVAL '1 second'
+            AND (l.earn_date IS DISTINCT FROM $3::date OR l.today_earn < $6)
+            RETURNING chat_xp, today_earn, earn_date, last_get, notif
             """,
             member.id,
             member.guild.id,
             get_dt_now(),
-        )
-
-    async def update_xp(
-        self,
-        member: discord.Member,
-        xp: int,
-        *,
-        is_voice: bool = False,
-    ):
-        query = "voice_xp" if is_voice else "chat_xp"
-        current_xp = await self.bot.pool.fetchval(
-            f"SELECT {query} FROM levels WHERE user_id = $1 AND guild_id = $2",
-            member.id,
-            member.guild.id,
-        )
-
-        current_level = self.get_level(current_xp)
-        future_level = self.get_level(current_xp + xp)
-        await self.bot.pool.execute(
-            f"""
-            UPDATE levels
-            SET {query} = {query} + $1, last_get = $4, today_earn = today_earn + $1
-            WHERE user_id = $2 AND guild_id = $3
-            """,
             xp,
-            member.id,
-            member.guild.id,
-            get_dt_now(),
-        )
-        return current_level, future_level
-
-    def get_level(self, xp: int) -> int:
-        a = 100
-        b = 1.5
-        level = 1
-        xp_required = a * (b ** (level - 1))
-        while xp >= xp_required:
-            level += 1
-            xp_required = a * (b ** (level - 1))
-        return level - 1
-
-    def get_xp_required(self, level: int) -> int:
-        a = 100
-        b = 1.5
-        xp_required = a * (b ** (level - 1))
-        return round(xp_required)
-
-    async def get_notif(self, member: discord.Member):
-        return await self.bot.pool.fetchval(
-            "SELECT notif FROM levels WHERE user_id = $1 AND guild_id = $2",
-            member.id,
-            member.guild.id,
+            COOLDOWN,
+            DAILY_CAP,
         )
 
 
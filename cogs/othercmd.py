@@ -25,8 +25,16 @@ class OtherCMDCog(commands.Cog, name="other"):
         self.bot.tree.add_command(self.quote_ctx_menu)
         self.bot.tree.add_command(self.hao_se_o_ctx_menu)
         self.bot.tree.add_command(self.mark_fbi_ctx_menu)
+        self.bot.router.register(
+            "other.chance", self.on_chance, keywords=("機率",), ignore_bots=False
+        )
+        self.bot.router.register(
+            "other.hao_se_o", self.on_hao_se_o, keywords=("好色喔",), ignore_bots=False
+        )
 
     async def cog_unload(self) -> None:
+        self.bot.router.unregister("other.chance")
+        self.bot.router.unregister("other.hao_se_o")
         self.bot.tree.remove_command(self.quote_ctx_menu.name, type=self.quote_ctx_menu.type)
         self.bot.tree.remove_command(self.hao_se_o_ctx_menu.name, type=self.hao_se_o_ctx_menu.type)
         self.bot.tree.remove_command(self.mark_fbi_ctx_menu.name, type=self.mark_fbi_ctx_menu.type)
@@ -73,21 +81,18 @@ class OtherCMDCog(commands.Cog, name="other"):
         assert isinstance(channel, discord.TextChannel)
         await channel.send(embed=embed)
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message) -> None:
-        if message.author == self.bot.user:
-            return
-        if "機率" in message.content:
-            value = random.randint(1, 100)
-            await message.reply(f"{value}%")
-        if "好色喔" in message.content:
-            emojis = [
-                "<:__1:1062180387922645082>",
-                "<:__2:1062180392246980638>",
-                "<:__3:1062180394906177678>",
-            ]
-            for e in emojis:
-                await message.add_reaction(e)
+    async def on_chance(self, message: discord.Message, _: frozenset[str]) -> None:
+        value = random.randint(1, 100)
+        await message.reply(f"{value}%")
+
+    async def on_hao_se_o(self, message: discord.Message, _: frozenset[str]) -> None:
+        emojis = [
+            "<:__1:1062180387922645082>",
+            "<:__2:1062180392246980638>",
+            "<:__3:1062180394906177678>",
+        ]
+        for e in emojis:
+            await message.add_reaction(e)
 
     @app_commands.command(name="ping", description="查看機器人目前延遲")
     async def ping(self, interaction: discord.Interaction) -> None:
@@ -34,9 +34,16 @@ class Schedule(commands.Cog):
 
     async def cog_load(self) -> None:
         self.notif_task.start()
+        self.bot.router.register(
+            "schedule.codes",
+            self.on_code_message,
+            channel_ids=(1168910418526355536,),
+            ignore_bots=False,
+        )
 
     async def cog_unload(self) -> None:
         self.notif_task.cancel()
+        self.bot.router.unregister("schedule.codes")
 
     @tasks.loop(hours=1)
     async def notif_task(self) -> None:
@@ -111,12 +118,8 @@ class Schedule(commands.Cog):
     async def before_notif_task(self) -> None:
         await self.bot.wait_until_ready()
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message) -> Any:
+    async def on_code_message(self, message: discord.Message, _: frozenset[str]) -> Any:
         """Auto mention role for #兌換碼 channel, I don't want to make a new cog for this so yeah."""
-        if message.channel.id != 1168910418526355536:
-            return
-
         codes = self.extract_codes_from_message(message.content)
 
         if "Honkai: Star Rail" in message.author.name:
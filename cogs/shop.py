@@ -4,7 +4,7 @@ import discord
 from discord import app_commands, ui
 from discord.ext import commands
 
-from apps.flow import flow_transaction, get_balance, register_account
+from apps.flow import InsufficientFlowError, register_account, transfer
 from apps.shop import create_shop_item, delete_shop_item, get_item_names
 from dev.enum import ShopAction
 from dev.model import BaseView, DefaultEmbed, ErrorEmbed, Inter
@@ -43,8 +43,9 @@ class ShopItemSelect(ui.Select):
             flow = await i.client.pool.fetchval(
                 "SELECT flow FROM flow_shop WHERE name = $1", self.values[0]
             )
-            user_flow = await get_balance(i.user.id, i.client.pool)
-            if user_flow < flow:
+            try:
+                await transfer(i.user.id, None, flow, i.client.pool, reason="shop")
+            except InsufficientFlowError:
                 return await i.response.send_message(
                     embed=ErrorEmbed().set_author(
                         name="你的暴幣不足夠購買這項商品", icon_url=i.user.display_avatar.url
@@ -52,7 +53,6 @@ class ShopItemSelect(ui.Select):
                     ephemeral=True,
                 )
 
-            await flow_transaction(i.user.id, -flow, i.client.pool)
             await i.response.send_message(
                 f"<:wish:982419859117838386> {i.user.mention} 商品 **{self.values[0]}** 購買成功, 請等候律律來交付商品"
             )
@@ -2,16 +2,21 @@ import random
 from typing import TYPE_CHECKING
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from loguru import logger
 
-from apps.flow import register_account, remove_account
+from apps.flow import forget_account, register_account, remove_account
+from apps.reconcile import find_departed, purge_departed
 from data.constants import welcome_strs
 from ui.welcome import AcceptRules, Welcome
 from utility.utils import default_embed
 
 if TYPE_CHECKING:
+    from collections import defaultdict
+
+    from apps.level.leaderboard import XPColumn
     from dev import model
+    from utility.rank import RankIndex
 
 
 class WelcomeCog(commands.Cog):
@@ -20,6 +25,57 @@ class WelcomeCog(commands.Cog):
         self.accept_view = AcceptRules()
         self.bot.add_view(self.accept_view)
 
+    async def cog_load(self) -> None:
+        self.reconcile_members.start()
+
+    async def cog_unload(self) -> None:
+        self.reconcile_members.cancel()
+
+    @tasks.loop(hours=1)
+    async def reconcile_members(self) -> None:
+        # the level cog owns the level rank indexes, it may be reloaded so don't hold on to it
+        level_ranks = getattr(self.bot.get_cog("level"), "ranks", None)
+        for guild in self.bot.guilds:
+            # one failing guild shouldn't stop the others, or stop the loop for good
+            try:
+                await self.reconcile_guild(guild, level_ranks)
+            except Exception:
+                logger.exception(f"Failed to reconcile the members of {guild.id}")
+
+    async def reconcile_guild(
+        self,
+        guild: discord.Guild,
+        level_ranks: "defaultdict[tuple[int, XPColumn], RankIndex] | None",
+    ) -> None:
+        if not guild.chunked:
+            # guilds aren't chunked at startup, and a partial member cache would make
+            # everyone missing from it look departed
+            await guild.chunk()
+        if not guild.chunked:
+            logger.warning(f"Failed to chunk {guild.id}, skipping it")
+            return
+
+        departed = await find_departed(
+            guild.id,
+            {m.id for m in guild.members},
+            self.bot.pool,
+            flow=guild.id == self.bot.guild_id,
+        )
+        if not departed:
+            return
+        await purge_departed(guild.id, departed, self.bot.pool)
+
+        for user_id in departed.flow:
+            forget_account(user_id)
+        if level_ranks is not None:
+            for user_id in departed.levels:
+                level_ranks[guild.id, "chat_xp"].remove(user_id)
+                level_ranks[guild.id, "voice_xp"].remove(user_id)
+
+    @reconcile_members.before_loop
+    async def before_reconcile_members(self) -> None:
+        await self.bot.wait_until_ready()
+
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member) -> None:
         if member.guild.id != self.bot.guild_id:
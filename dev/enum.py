@@ -15,3 +15,9 @@ class ShopAction(Enum):
 class GameType(Enum):
     GUESS_NUM = "guess_num"
     CONNECT_FOUR = "connect_four"
+
+
+class Difficulty(Enum):
+    EASY = "easy"
+    NORMAL = "normal"
+    HARD = "hard"
@@ -12,11 +12,14 @@ if typing.TYPE_CHECKING:
     import aiohttp
     import asyncpg
 
+    from utility.triggers import MessageRouter
+
 
 class BotModel(commands.Bot):
     user: discord.ClientUser
     session: "aiohttp.ClientSession"
     pool: "asyncpg.Pool"
+    router: "MessageRouter"
     debug: bool = False
     guild_id = 1061877505067327528
 
@@ -148,6 +151,8 @@ class GuessNumMatch(BaseModel):
 
     p1_guess: int
     p2_guess: int
+    p1_guesses: list[str] = []
+    p2_guesses: list[str] = []
 
     channel_id: int
     flow: int | None = None
@@ -161,6 +166,8 @@ class GuessNumMatch(BaseModel):
             p2_num=row["player_two_num"],
             p1_guess=row["player_one_guess"],
             p2_guess=row["player_two_guess"],
+            p1_guesses=row["player_one_guesses"],
+            p2_guesses=row["player_two_guesses"],
             channel_id=row["channel_id"],
             flow=row["flow"],
         )
@@ -13,6 +13,7 @@ from dotenv import load_dotenv
 from loguru import logger
 
 from dev.model import BotModel, ErrorEmbed
+from utility.triggers import MessageRouter
 
 if TYPE_CHECKING:
     from discord.abc import User
@@ -68,6 +69,7 @@ class ShenheBot(BotModel):
             tree_cls=ShenheCommandTree,
             chunk_guilds_at_startup=False,
         )
+        self.router = MessageRouter()
 
     async def is_owner(self, user: "User") -> bool:
         return await super().is_owner(user) or user.id == 801453818243448884  # lin
@@ -94,6 +96,7 @@ class ShenheBot(BotModel):
         if self.user and message.author.id == self.user.id:
             return
         await self.process_commands(message)
+        await self.router.dispatch(message)
 
     async def on_command_error(self, ctx: commands.Context, error: Exception) -> None:
         if hasattr(ctx.command, "on_error"):
@@ -106,9 +109,10 @@ class ShenheBot(BotModel):
             logger.error(f"Error in command {ctx.command}: {error}")
 
     async def close(self) -> None:
+        # cogs flush their write-behind state on unload, which happens in super().close()
+        await super().close()
         await self.pool.close()
         await self.session.close()
-        return await super().close()
 
 
 bot = ShenheBot()
@@ -1,9 +1,12 @@
+import random
 import uuid
 
 import discord
 from discord import ui
 
-from dev.model import BaseView, DefaultEmbed, ErrorEmbed, Inter
+from apps.guess_num import CODES
+from apps.matches import start_guess_num
+from dev.model import BaseView, DefaultEmbed, ErrorEmbed, GuessNumMatch, Inter
 
 
 class GuessNumView(BaseView):
@@ -58,7 +61,7 @@ class GuessNumModal(ui.Modal):
         self.gn_view = gn_view
 
     async def on_submit(self, i: Inter, /) -> None:
-        if not self.number.value.isdigit():
+        if not (self.number.value.isascii() and self.number.value.isdigit()):
             return await i.response.send_message(
                 embed=ErrorEmbed("請勿輸入數字以外的內容"), ephemeral=True
             )
@@ -95,6 +98,10 @@ class GuessNumModal(ui.Modal):
             self.gn_view.p1_num = self.number.value
             p1_button.disabled = True
             p2_button.disabled = False
+            if p2.bot:
+                # Shenhe's number is set right away
+                self.gn_view.p2_num = random.choice(CODES)
+                p2_button.disabled = True
         else:
             self.gn_view.p2_num = self.number.value
             p2_button.disabled = True
@@ -110,7 +117,7 @@ class GuessNumModal(ui.Modal):
                 value=f"{p1.mention} - **設定完成**",
                 inline=False,
             )
-        else:
+        if not self.is_p1 or p2.bot:
             embed.set_field_at(
                 1,
                 name="玩家二",
@@ -127,20 +134,20 @@ class GuessNumModal(ui.Modal):
                 name=f"猜數字-{str(uuid.uuid4())[:4]}"
             )
             await thread.add_user(p1)
-            await thread.add_user(p2)
-            await i.client.pool.execute(
-                """
-                INSERT INTO guess_num
-                (channel_id, player_one, player_two,
-                flow, player_one_num, player_two_num)
-                VALUES ($1, $2, $3, $4, $5, $6)
-                """,
-                thread.id,
-                p1.id,
-                p2.id,
-                self.gn_view.flow,
-                self.gn_view.p1_num,
-                self.gn_view.p2_num,
+            if not p2.bot:
+                await thread.add_user(p2)
+            await start_guess_num(
+                GuessNumMatch(
+                    p1=p1.id,
+                    p2=p2.id,
+                    p1_num=self.gn_view.p1_num,
+                    p2_num=self.gn_view.p2_num,
+                    p1_guess=0,
+                    p2_guess=0,
+                    channel_id=thread.id,
+                    flow=self.gn_view.flow,
+                ),
+                i.client.pool,
             )
 
             await thread.send(
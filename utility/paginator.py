@@ -1,10 +1,13 @@
 import typing
+from collections import OrderedDict
 
 import discord
 from discord import ui
 
 from dev.model import BaseView
 
+PageProvider = typing.Callable[[int], typing.Awaitable[discord.Embed]]
+
 
 class GeneralPaginatorView(BaseView):
     def __init__(
@@ -16,6 +19,14 @@ class GeneralPaginatorView(BaseView):
         self.embeds = embeds
         self.current_page = 0
 
+    @property
+    def page_count(self) -> int:
+        return len(self.embeds)
+
+    async def get_page(self, index: int) -> discord.Embed:
+        """Get the embed of a page, override to render pages on demand"""
+        return self.embeds[index]
+
     async def update_children(self, i: discord.Interaction) -> None:
         """Called when a button is pressed"""
         self.update_components()
@@ -24,15 +35,16 @@ class GeneralPaginatorView(BaseView):
     def update_components(self) -> None:
         """Update the buttons and the page label"""
         self.first.disabled = self.current_page == 0
-        self.next.disabled = self.current_page + 1 == len(self.embeds)
+        self.next.disabled = self.current_page + 1 == self.page_count
         self.previous.disabled = self.current_page <= 0
-        self.last.disabled = self.current_page + 1 == len(self.embeds)
+        self.last.disabled = self.current_page + 1 == self.page_count
 
-        self.page.label = f"第{self.current_page + 1}/{len(self.embeds)}頁"
+        self.page.label = f"第{self.current_page + 1}/{self.page_count}頁"
 
     async def make_response(self, i: discord.Interaction) -> None:
         """Make the response for the interaction"""
-        await i.response.edit_message(embed=self.embeds[self.current_page], view=self)
+        embed = await self.get_page(self.current_page)
+        await i.response.edit_message(embed=embed, view=self)
 
     @ui.button(
         emoji="<:double_left:982588991461281833>",
@@ -83,22 +95,62 @@ class GeneralPaginatorView(BaseView):
         custom_id="paginator_double_right",
     )
     async def last(self, i: discord.Interaction, _: ui.Button) -> None:
-        self.current_page = len(self.embeds) - 1
+        self.current_page = self.page_count - 1
 
         await self.update_children(i)
 
 
+class LazyPaginatorView(GeneralPaginatorView):
+    def __init__(
+        self,
+        provider: PageProvider,
+        page_count: typing.Callable[[], int],
+        cache_size: int = 5,
+    ) -> None:
+        super().__init__([])
+
+        self.provider = provider
+        self.count = page_count
+        self.cache_size = cache_size
+        self.cache: OrderedDict[int, discord.Embed] = OrderedDict()
+
+    @property
+    def page_count(self) -> int:
+        return self.count()
+
+    async def get_page(self, index: int) -> discord.Embed:
+        """Render a page with the provider, keeping the most recently viewed pages"""
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            return self.cache[index]
+
+        embed = await self.provider(index)
+        self.cache[index] = embed
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return embed
+
+
 class GeneralPaginator:
     def __init__(
         self,
         i: discord.Interaction,
-        embeds: list[discord.Embed],
+        embeds: list[discord.Embed] | None = None,
         custom_children: list[ui.Button | ui.Select] | None = None,
+        *,
+        provider: PageProvider | None = None,
+        page_count: typing.Callable[[], int] | None = None,
     ) -> None:
+        """Paginate a list of embeds, or render pages on demand with `provider` and `page_count`."""
         if custom_children is None:
             custom_children = []
+        if (embeds is None) == (provider is None) or (provider is None) != (page_count is None):
+            msg = "Pass either embeds, or provider and page_count"
+            raise ValueError(msg)
         self.i = i
-        self.embeds = embeds
+        self.embeds = embeds or []
+        self.provider = provider
+        self.page_count = page_count
         self.custom_children = custom_children
 
     async def start(
@@ -107,22 +159,19 @@ class GeneralPaginator:
         followup: bool = False,
         ephemeral: bool = False,
     ) -> None:
-        if not self.embeds:
+        view = self.setup_view()
+        if view.page_count == 0:
             msg = "Missing embeds"
             raise ValueError(msg)
 
-        view = self.setup_view()
         view.author = self.i.user
-        view.first.disabled = view.previous.disabled = True
-        view.last.disabled = view.next.disabled = len(self.embeds) == 1
-
-        view.page.label = f"第1/{len(self.embeds)}頁"
+        view.update_components()
 
         if len(self.custom_children) > 0:
             for child in self.custom_children:
                 view.add_item(child)
 
-        kwargs = self.setup_kwargs(view)
+        kwargs = self.setup_kwargs(view, await view.get_page(0))
         if ephemeral:
             kwargs["ephemeral"] = ephemeral
 
@@ -140,10 +189,14 @@ class GeneralPaginator:
         view.message = await self.i.original_response()
         await view.wait()
 
-    def setup_kwargs(self, view: GeneralPaginatorView) -> dict[str, typing.Any]:
-        kwargs: dict[str, typing.Any] = {"embed": self.embeds[0], "view": view}
+    def setup_kwargs(
+        self, view: GeneralPaginatorView, embed: discord.Embed
+    ) -> dict[str, typing.Any]:
+        kwargs: dict[str, typing.Any] = {"embed": embed, "view": view}
         return kwargs
 
     def setup_view(self) -> GeneralPaginatorView:
+        if self.provider is not None and self.page_count is not None:
+            return LazyPaginatorView(self.provider, self.page_count)
         view = GeneralPaginatorView(self.embeds)
         return view
@@ -0,0 +1,68 @@
+SCORE_LIMIT = 1 << 40
+"""Scores must be in [-SCORE_LIMIT, SCORE_LIMIT)."""
+
+_SIZE = 2 * SCORE_LIMIT
+
+
+class RankIndex:
+    """Scores of a leaderboard counted in a Fenwick tree for O(log n) updates and rank lookups.
+
+    The tree is over score values rather than members, stored sparsely in a dict so only the
+    nodes on the paths of used scores exist. Members with the same score share a rank, like
+    RANK() in SQL.
+    """
+
+    def __init__(self) -> None:
+        self._scores: dict[int, int] = {}
+        self._tree: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._scores
+
+    def _add(self, score: int, delta: int) -> None:
+        i = score + SCORE_LIMIT + 1
+        while i <= _SIZE:
+            self._tree[i] = self._tree.get(i, 0) + delta
+            i += i & -i
+
+    def _count_at_most(self, score: int) -> int:
+        """Get the number of members scoring `score` or less."""
+        count, i = 0, score + SCORE_LIMIT + 1
+        while i:
+            count += self._tree.get(i, 0)
+            i &= i - 1
+        return count
+
+    def load(self, scores: dict[int, int]) -> None:
+        """Replace every score in the index."""
+        self._scores = {}
+        self._tree = {}
+        for user_id, score in scores.items():
+            self.set(user_id, score)
+
+    def set(self, user_id: int, score: int) -> None:
+        if not -SCORE_LIMIT <= score < SCORE_LIMIT:
+            msg = f"Score {score} is out of range"
+            raise ValueError(msg)
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self._add(old, -1)
+        self._scores[user_id] = score
+        self._add(score, 1)
+
+    def remove(self, user_id: int) -> None:
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            self._add(old, -1)
+
+    def rank(self, user_id: int) -> int | None:
+        """Get a member's rank, None if the member is not in the index."""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return len(self._scores) - self._count_at_most(score) + 1
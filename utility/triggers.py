@@ -0,0 +1,183 @@
+import asyncio
+import re
+import time
+import typing
+
+import discord
+from attrs import define, field
+from loguru import logger
+
+
+class KeywordMatcher:
+    """Finds every keyword contained in a text with one regex scan.
+
+    The keywords are compiled into a single lookahead alternation, longest first, so
+    each position of the text yields the longest keyword starting there. Any shorter
+    keyword starting at the same position is a substring of it, so every keyword
+    also remembers the keywords it contains.
+    """
+
+    def __init__(self, keywords: typing.Iterable[str]) -> None:
+        self.keywords = frozenset(k.lower() for k in keywords if k)
+        ordered = sorted(self.keywords, key=len, reverse=True)
+        self._contains = {k: frozenset(o for o in self.keywords if o in k) for k in ordered}
+        self._regex = re.compile(f"(?=({'|'.join(map(re.escape, ordered))}))") if ordered else None
+
+    def find(self, text: str) -> frozenset[str]:
+        """Get the keywords contained in an already lowercased text."""
+        if self._regex is None:
+            return frozenset()
+        found: set[str] = set()
+        for match in self._regex.finditer(text):
+            found |= self._contains[match.group(1)]
+        return frozenset(found)
+
+
+MessageHandler = typing.Callable[[discord.Message, frozenset[str]], typing.Awaitable[typing.Any]]
+
+
+@define
+class RouteStats:
+    calls: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+    @property
+    def avg_time(self) -> float:
+        return self.total_time / self.calls if self.calls else 0.0
+
+
+@define
+class Route:
+    name: str
+    handler: MessageHandler
+    ignore_bots: bool = True
+    guild_only: bool = False
+    thread_only: bool = False
+    channel_ids: frozenset[int] = field(factory=frozenset)
+    thread_name: str | None = None
+    keywords: frozenset[str] = field(factory=frozenset)
+    exclude: frozenset[str] = field(factory=frozenset)
+    pattern: re.Pattern[str] | None = None
+    stats: RouteStats = field(factory=RouteStats)
+
+    @property
+    def reads_content(self) -> bool:
+        return bool(self.keywords or self.exclude or self.pattern)
+
+    def accepts(self, message: discord.Message) -> bool:
+        """Check the filters that don't need the message content."""
+        channel = message.channel
+        if self.ignore_bots and message.author.bot:
+            return False
+        if self.guild_only and message.guild is None:
+            return False
+        if (self.thread_only or self.thread_name is not None) and not isinstance(
+            channel, discord.Thread
+        ):
+            return False
+        if self.channel_ids and channel.id not in self.channel_ids:
+            return False
+        return self.thread_name is None or self.thread_name in channel.name  # type: ignore
+
+    def accepts_content(self, content: str, found: frozenset[str]) -> bool:
+        if self.keywords and self.keywords.isdisjoint(found):
+            return False
+        if not self.exclude.isdisjoint(found):
+            return False
+        return self.pattern is None or self.pattern.search(content) is not None
+
+
+class MessageRouter:
+    """Routes messages to the handlers cogs register, dispatched from the bot's `on_message`.
+
+    The cheap filters of every route are checked first. Only if a remaining route
+    looks at the content is the message lowercased and scanned, once, by a
+    `KeywordMatcher` shared by every route. Matched handlers run concurrently and
+    their timings are kept in `Route.stats`.
+    """
+
+    def __init__(self) -> None:
+        self.routes: dict[str, Route] = {}
+        self._matcher = KeywordMatcher(())
+
+    def register(
+        self,
+        name: str,
+        handler: MessageHandler,
+        *,
+        ignore_bots: bool = True,
+        guild_only: bool = False,
+        thread_only: bool = False,
+        channel_ids: typing.Iterable[int] = (),
+        thread_name: str | None = None,
+        keywords: typing.Iterable[str] = (),
+        exclude: typing.Iterable[str] = (),
+        pattern: str | None = None,
+    ) -> None:
+        """Register a route, replacing any route with the same name.
+
+        Every given filter has to pass for the handler to be called.
+
+        Args:
+            name (str): Unique name of the route.
+            handler (MessageHandler): Called with the message and the keywords found in it.
+            ignore_bots (bool): Whether messages sent by bots are ignored.
+            guild_only (bool): The message has to be sent in a guild.
+            thread_only (bool): The message has to be sent in a thread.
+            channel_ids (Iterable[int]): The message has to be sent in one of these channels.
+            thread_name (str | None): The message has to be sent in a thread whose name contains this.
+            keywords (Iterable[str]): At least one of these has to be in the message.
+            exclude (Iterable[str]): None of these may be in the message.
+            pattern (str | None): A regex that has to match the lowercased message.
+        """
+        self.routes[name] = Route(
+            name=name,
+            handler=handler,
+            ignore_bots=ignore_bots,
+            guild_only=guild_only,
+            thread_only=thread_only,
+            channel_ids=frozenset(channel_ids),
+            thread_name=thread_name,
+            keywords=frozenset(k.lower() for k in keywords),
+            exclude=frozenset(k.lower() for k in exclude),
+            pattern=re.compile(pattern) if pattern is not None else None,
+        )
+        self._rebuild()
+
+    def unregister(self, name: str) -> None:
+        self.routes.pop(name, None)
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._matcher = KeywordMatcher(
+            k for r in self.routes.values() for k in r.keywords | r.exclude
+        )
+
+    async def _run(self, route: Route, message: discord.Message, found: frozenset[str]) -> None:
+        start = time.perf_counter()
+        try:
+            await route.handler(message, found)
+        except Exception as e:
+            route.stats.errors += 1
+            logger.error(f"Error in message route {route.name}: {e}", exc_info=e)
+        finally:
+            elapsed = time.perf_counter() - start
+            route.stats.calls += 1
+            route.stats.total_time += elapsed
+            route.stats.max_time = max(route.stats.max_time, elapsed)
+
+    async def dispatch(self, message: discord.Message) -> None:
+        """Call the handler of every route the message passes the filters of."""
+        routes = [r for r in self.routes.values() if r.accepts(message)]
+        if not routes:
+            return
+
+        found: frozenset[str] = frozenset()
+        if any(r.reads_content for r in routes):
+            content = message.content.lower()
+            found = self._matcher.find(content)
+            routes = [r for r in routes if r.accepts_content(content, found)]
+
+        await asyncio.gather(*(self._run(r, message, found) for r in routes))